@@ -1,109 +1,223 @@
-import csv
-import json
+import argparse
+import asyncio
+import itertools
+import logging
 import os
+import pickle
 import socket
-import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+try:
+    import pandas as pd
+except ImportError:  # без pandas CSV разбирается построчно
+    pd = None
+
+try:
+    import lz4.frame
+except ImportError:  # сжатие потока доступно только с установленным lz4
+    lz4 = None
 
 HOST = '127.0.0.1'
 PORT = 8081  # Изменен порт, чтобы избежать конфликта с системными ограничениями
 SENDING_INTERVAL_SECONDS = 1
+FRAMES_PER_SEND = 1  # Больше 1 - отсчеты отправляются пачкой одной записью за интервал
+SEND_BUFFER_SIZE = 64 * 1024
+LISTEN_BACKLOG = 128
+# Клиент, поддерживающий LZ4, отправляет этот байт сразу после подключения
+LZ4_HANDSHAKE = b'L'
+HANDSHAKE_TIMEOUT_SECONDS = 0.5
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 DATA_PATH = os.path.join(current_dir, '..', 'dataset', 'ЛЦТ _НПП _ИТЭЛМА_')
 DATA_MAX_FILES_TO_LOAD = 100
+# Разобранные данные кешируются; кеш сбрасывается при изменении набора файлов или их mtime
+CACHE_PATH = os.path.join(current_dir, 'test_data.pkl')
 CSV_FIELDS_SEPARATOR = ','
-
-TEST_DATA = []
-
-
-def load_test_data():
-    result = []
-    files_count = 0
+CTG_TYPES = ('bpm', 'uterus')
+# Схема сообщения фиксирована; str() для float32 дает кратчайшую точную запись числа.
+# Кадры собираются по шаблону один раз при старте, JSON-кодировщик в цикле отправки не нужен
+FRAME_TEMPLATE = b'{"bpm":[%s,%s],"uterus":[%s,%s]}\n'
+_SEPARATOR = CSV_FIELDS_SEPARATOR.encode()
+
+logger = logging.getLogger(__name__)
+
+
+def load_csv_file(file_path):
+    if pd is None:
+        return _load_csv_file_py(file_path)
+    frame = pd.read_csv(file_path, sep=CSV_FIELDS_SEPARATOR, header=None, usecols=[0, 1],
+                        engine='c', on_bad_lines='skip', memory_map=True)
+    # Заголовок и нечисловые строки превращаются в NaN и отбрасываются
+    rows = frame.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float32)
+    return rows[np.isfinite(rows).all(axis=1)]
+
+
+def _load_csv_file_py(file_path):
+    rows = []
+    with open(file_path, 'rb') as csvfile:
+        for line in csvfile:
+            # float() одновременно проверяет и разбирает значение, заголовок отсеивается исключением
+            try:
+                time_sec, value = line.split(_SEPARATOR)
+                rows.append((float(time_sec), float(value)))
+            except ValueError:
+                pass
+    rows = np.array(rows, dtype=np.float32).reshape(-1, 2)
+    return rows[np.isfinite(rows).all(axis=1)]
+
+
+def find_test_files():
+    tasks = []
+    base_depth = DATA_PATH.rstrip(os.sep).count(os.sep)
     for root, dirs, files in os.walk(DATA_PATH):
+        depth = root.count(os.sep) - base_depth
+        # Уровни: disease/patient/ctg_type; в лишние каталоги обход не спускается
+        if depth == 2:
+            dirs[:] = [d for d in dirs if d in CTG_TYPES]
+        elif depth >= 3:
+            dirs[:] = []
+        if depth != 3:
+            continue
+
+        # Путь заканчивается на disease/patient/ctg_type, разбираем его одним проходом
+        disease_type, patient_id, ctg_type = root.rsplit(os.sep, 3)[-3:]
         for file in (x for x in files if x.lower().endswith('.csv')):
-            base, ctg_type = os.path.split(root)
+            tasks.append((disease_type, patient_id, ctg_type, os.path.join(root, file)))
+            if len(tasks) >= DATA_MAX_FILES_TO_LOAD:
+                return tasks
+    return tasks
 
-            # --- ВОТ ЭТА ПРОВЕРКА ---
-            if ctg_type not in ['bpm', 'uterus']:
-                continue  # Пропускаем этот файл и идем к следующему
-            # ------------------------
 
-            base, patient_id = os.path.split(base)
-            base, disease_type = os.path.split(base)
+def load_cache(signature):
+    # Битый, устаревший или чужой кеш не мешает запуску: данные просто разбираются из CSV заново
+    try:
+        with open(CACHE_PATH, 'rb') as f:
+            cached = pickle.load(f)
+    except Exception as e:
+        if not isinstance(e, FileNotFoundError):
+            logger.warning('Unable to load cache %s: %s', CACHE_PATH, e)
+        return None
+    if not isinstance(cached, dict) or cached.get('signature') != signature:
+        return None
+    patients = cached.get('patients')
+    return patients if isinstance(patients, list) else None
+
+
+def save_cache(signature, patients):
+    try:
+        with open(CACHE_PATH, 'wb') as f:
+            pickle.dump({'signature': signature, 'patients': patients}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        logger.warning('Unable to save cache %s: %s', CACHE_PATH, e)
 
-            file_path = os.path.join(root, file)
-            with open(file_path, newline='') as csvfile:
-                rows = []
-                csv_reader = csv.reader(csvfile, delimiter=CSV_FIELDS_SEPARATOR)
-                for row in (x for x in csv_reader if len(x) == 2):
-                    if is_number(row[0]) and is_number(row[1]):
-                        rows.append([row[0], row[1]])
-                result.append((disease_type, patient_id, ctg_type, rows))
-                print(f'File {file_path} successfully loaded')
-                files_count += 1
-                if files_count >= DATA_MAX_FILES_TO_LOAD:
-                    return result
-    return result
 
+def load_test_data():
+    tasks = find_test_files()
+    signature = [(task[3], os.path.getmtime(task[3])) for task in tasks]
+    patients = load_cache(signature)
+    if patients is not None:
+        logger.info('Test data loaded from cache %s', CACHE_PATH)
+        return patients
+
+    # Пациенты собираются сразу при загрузке; места под файлы резервируются в порядке обхода,
+    # чтобы пары bpm/uterus совпадали независимо от порядка завершения процессов
+    result = {}
+    slots = []
+    for disease_type, patient_id, ctg_type, file_path in tasks:
+        patient = result.setdefault((disease_type, patient_id), {'disease_type': disease_type, 'patient_id': patient_id,
+                                                                 'bpm': [], 'uterus': []})
+        slots.append((patient[ctg_type], len(patient[ctg_type])))
+        patient[ctg_type].append(None)
 
-def read_test_data():
-    while True:
-        yield from TEST_DATA
+    with ProcessPoolExecutor() as executor:
+        futures = {executor.submit(load_csv_file, task[3]): index for index, task in enumerate(tasks)}
+        for future in as_completed(futures):
+            index = futures[future]
+            files, position = slots[index]
+            files[position] = future.result()
+            logger.debug('File %s successfully loaded', tasks[index][3])
 
+    patients = list(result.values())
+    save_cache(signature, patients)
+    return patients
 
-def is_number(s):
-    try:
-        float(s)
-        return True
-    except ValueError:
-        return False
-
-
-def start_server():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((HOST, PORT))
-        s.listen()
-        print(f'Server started {HOST}:{PORT}, sending interval {SENDING_INTERVAL_SECONDS} seconds')
-        conn, addr = s.accept()
-        with conn:
-            for test_data_value in read_test_data():
-                try:
-                    bpm_files_len = len(test_data_value['bpm'])
-                    uterus_files_len = len(test_data_value['uterus'])
-
-                    for i in range(0, min(bpm_files_len, uterus_files_len) - 1):
-                        bpm_len = len(test_data_value['bpm'][i])
-                        uterus_len = len(test_data_value['uterus'][i])
-
-                        for k in range(0, min(bpm_len, uterus_len) - 1):
-                            message = json.dumps({
-                                'bpm': [test_data_value['bpm'][i][k][0], test_data_value['bpm'][i][k][1]],
-                                'uterus': [test_data_value['uterus'][i][k][0], test_data_value['uterus'][i][k][1]]
-                            }).encode('utf-8')
-                            print(f'Sending message: {message}')
-                            conn.sendall(message + b'\n')
-                            time.sleep(SENDING_INTERVAL_SECONDS)
-
-                except Exception as e:
-                    print(f"Error: {e}")
-                    conn, addr = s.accept()
-
-
-def transform_data(source_data):
-    result = {}
 
-    for disease_type, patient_id, ctg_type, ctg_values in source_data:
-        patient = f'{disease_type}_{patient_id}'
-        if patient not in result:
-            result[patient] = {'disease_type': disease_type, 'patient_id': patient_id, 'bpm': [], 'uterus': []}
+def read_test_data(frames):
+    return itertools.cycle(frames)
 
-        result[patient][ctg_type].append(ctg_values)
 
-    return list(result.values())
+def configure_client_socket(sock):
+    # Кадры маленькие и отправляются по одному, Nagle только добавляет задержку
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_SIZE)
+    # Отвалившийся без FIN клиент обнаруживается и не держит соединение вечно
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+
+async def negotiate_compression(reader):
+    try:
+        hello = await asyncio.wait_for(reader.read(len(LZ4_HANDSHAKE)), HANDSHAKE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        return None
+    if hello != LZ4_HANDSHAKE:
+        return None
+    # autoflush отдает сжатые данные сразу, связанные блоки сохраняют словарь между кадрами
+    return lz4.frame.LZ4FrameCompressor(autoflush=True)
+
+
+async def handle_client(reader, writer, frames, compress):
+    addr = writer.get_extra_info('peername')
+    configure_client_socket(writer.get_extra_info('socket'))
+    logger.info('Client connected %s:%s', *addr[:2])
+    try:
+        compressor = await negotiate_compression(reader) if compress else None
+        if compressor is not None:
+            logger.info('LZ4 compression enabled for %s:%s', *addr[:2])
+            writer.write(compressor.begin())
+        for message in read_test_data(frames):
+            logger.debug('Sending message: %s', message)
+            writer.write(message if compressor is None else compressor.compress(message))
+            await writer.drain()
+            await asyncio.sleep(SENDING_INTERVAL_SECONDS)
+    except OSError as e:
+        logger.error('Error: %s', e)
+    finally:
+        writer.close()
+    logger.info('Client disconnected %s:%s', *addr[:2])
+
+
+async def start_server(frames, compress=False):
+    # Все клиенты обслуживаются одним циклом событий, каждый получает свой проход по кадрам с начала
+    server = await asyncio.start_server(lambda reader, writer: handle_client(reader, writer, frames, compress),
+                                        HOST, PORT, backlog=LISTEN_BACKLOG, reuse_address=True)
+    logger.info('Server started %s:%s, sending interval %s seconds', HOST, PORT, SENDING_INTERVAL_SECONDS)
+    async with server:
+        await server.serve_forever()
+
+
+def precompute_frames(patients):
+    frames = []
+    for test_data_value in patients:
+        for bpm_arr, uterus_arr in zip(test_data_value['bpm'], test_data_value['uterus']):
+            for (bpm_time, bpm_value), (uterus_time, uterus_value) in zip(bpm_arr, uterus_arr):
+                frames.append(FRAME_TEMPLATE % (str(bpm_time).encode(), str(bpm_value).encode(),
+                                                str(uterus_time).encode(), str(uterus_value).encode()))
+    if FRAMES_PER_SEND > 1:
+        frames = [b''.join(frames[i:i + FRAMES_PER_SEND]) for i in range(0, len(frames), FRAMES_PER_SEND)]
+    return frames
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CTG device emulator')
+    parser.add_argument('--lz4', action='store_true',
+                        help='compress the stream with LZ4 for clients that send the handshake byte')
+    args = parser.parse_args()
+    if args.lz4 and lz4 is None:
+        parser.error('--lz4 requires the lz4 package')
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     data = load_test_data()
-    TEST_DATA = transform_data(data)
-    start_server()
\ No newline at end of file
+    frames = precompute_frames(data)
+    asyncio.run(start_server(frames, compress=args.lz4))
\ No newline at end of file
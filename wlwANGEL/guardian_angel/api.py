@@ -5,20 +5,25 @@ Real-time backend for CTG monitoring system with MIS integration
 
 import sys
 import csv
+import functools
+import inspect
+import io
+import itertools
 import os
 import time
 import asyncio
 import json
 import logging
 import httpx
-import glob
+from collections import deque
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from types import MappingProxyType
+from typing import List, Optional, Dict, Any, MutableMapping
 from datetime import datetime
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 
@@ -26,6 +31,26 @@ from pydantic import BaseModel, Field
 from db_manager import DBManager
 from final_prediction_service import PredictionService
 
+try:
+    import orjson
+except ImportError:  # без orjson используется стандартный json
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:  # без uvloop работает стандартный цикл событий asyncio
+    uvloop = None
+
+try:
+    import h2
+except ImportError:  # без h2 httpx отправляет архивы по HTTP/1.1
+    h2 = None
+
+try:
+    from cachetools import LRUCache
+except ImportError:  # без cachetools клинические данные хранятся в обычном словаре без вытеснения
+    LRUCache = None
+
 # ==================== НАСТРОЙКА ЛОГИРОВАНИЯ ====================
 logging.basicConfig(
     level=logging.INFO,
@@ -34,6 +59,42 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# ==================== СЕРИАЛИЗАЦИЯ ====================
+def _json_default(value: Any) -> Any:
+    # Массивы и скаляры numpy (например, fhr_values графика) - списком и числом, остальное - строкой
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+
+if orjson is not None:
+    def dumps_message(message: Any) -> str:
+        return orjson.dumps(message, default=_json_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    def dumps_bytes(message: Any) -> bytes:
+        # Для файлов и HTTP тел: без промежуточной строки
+        return orjson.dumps(message, default=_json_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+    # orjson.JSONDecodeError наследуется от json.JSONDecodeError
+    loads_message = orjson.loads
+else:
+    def dumps_message(message: Any) -> str:
+        return json.dumps(message, default=_json_default)
+
+    def dumps_bytes(message: Any) -> bytes:
+        return json.dumps(message, default=_json_default, separators=(',', ':')).encode('utf-8')
+
+    loads_message = json.loads
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON ответ, сериализуемый orjson (ORJSONResponse в FastAPI объявлен устаревшим)"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
+
 # ==================== КОНСТАНТЫ ====================
 DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'guardian_angel_data.db')
 EMULATOR_HOST = 'localhost'
@@ -41,19 +102,103 @@ EMULATOR_PORT = 8081
 RECONNECT_DELAY = 5  # секунд между попытками переподключения
 PREDICTION_INTERVAL = 10  # секунд между анализами
 ARCHIVES_QUEUE_DIR = "archives_to_send"  # Папка для очереди архивов
+ARCHIVES_ERROR_DIR = os.path.join(ARCHIVES_QUEUE_DIR, "errors")  # Архивы, которые не удалось отправить
+ARCHIVES_SENT_DIR = os.path.join(ARCHIVES_QUEUE_DIR, "sent")  # Успешно отправленные архивы
 ARCHIVE_SENDER_INTERVAL = 300  # Интервал проверки очереди (5 минут)
 ARCHIVE_SEND_TIMEOUT = 30  # Таймаут отправки архива
+ARCHIVE_RETRY_BACKOFF_MIN = 2  # секунд паузы после первой неудачной отправки
+ARCHIVE_RETRY_BACKOFF_MAX = 60  # предел паузы, удваивающейся после каждой неудачи подряд
+EXPORT_BATCH_SIZE = 5000  # Записей, читаемых из БД за раз при экспорте CSV
+BROADCAST_SEND_TIMEOUT = 2.0  # Таймаут отправки сообщения одному WebSocket клиенту
+WEBSOCKET_QUEUE_SIZE = 256  # Максимум неотправленных сообщений на одного клиента
+DB_BATCH_MAX_SIZE = 100  # Максимум отсчетов в одной записи в БД
+DB_BATCH_MAX_DELAY = 1.0  # секунд, сколько отсчет может ждать записи в БД
+STATUS_CACHE_TTL = 2.0  # секунд, сколько отдается закешированный ответ статусных эндпоинтов
+CLINICAL_DATA_MAX_SESSIONS = 10000  # Максимум сессий с клиническими данными в памяти
+
+# Счетчики в результате анализа, любой ненулевой из которых делает алерт критическим
+CRITICAL_PATTERNS = frozenset({
+    'deep_decelerations',
+    'prolonged_decelerations',
+    'late_decelerations'
+})
+
+# Заголовок CSV экспорта, в порядке столбцов DBManager.get()
+CSV_HEADER = ('id', 'ts', 'bpm_time', 'bpm_value', 'uterus_time', 'uterus_value')
+
+# Имена полей записи КТГ в архиве, в порядке столбцов DBManager.get()
+ARCHIVE_RECORD_FIELDS = ('id', 'timestamp', 'bpm_time', 'bpm_value', 'uterus_time', 'uterus_value')
+
+# ==================== КЕШ ОТВЕТОВ ====================
+
+def cached_response(ttl: float):
+    """Кеширует ответ эндпоинта без параметров на ttl секунд.
+
+    Дашборды опрашивают статус из нескольких вкладок, а данные за секунду-две не меняются.
+    Исключения не кешируются.
+    """
+    def decorator(func):
+        state = {'expires': 0.0, 'value': None}
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper():
+                now = time.monotonic()
+                if now >= state['expires']:
+                    state['value'] = await func()
+                    state['expires'] = now + ttl
+                return state['value']
+        else:
+            @functools.wraps(func)
+            def wrapper():
+                now = time.monotonic()
+                if now >= state['expires']:
+                    state['value'] = func()
+                    state['expires'] = now + ttl
+                return state['value']
+        return wrapper
+    return decorator
+
+
+# ==================== ВРЕМЕННЫЕ МЕТКИ ====================
+
+# ISO-метка строится один раз на секунду: отсчеты эмулятора и сообщения одной секунды ее разделяют
+_iso_cache = {'ts': 0, 'iso': ''}
+
+
+def iso_from_timestamp(unix_timestamp: int) -> str:
+    if unix_timestamp != _iso_cache['ts']:
+        _iso_cache['iso'] = datetime.fromtimestamp(unix_timestamp).isoformat()
+        _iso_cache['ts'] = unix_timestamp
+    return _iso_cache['iso']
+
+
+def now_iso() -> str:
+    """Текущее время в ISO формате с точностью до секунды"""
+    return iso_from_timestamp(int(time.time()))
+
 
 # ==================== ХРАНИЛИЩЕ КЛИНИЧЕСКИХ ДАННЫХ (эмуляция МИС) ====================
 # Словарь для хранения клинических данных пациентов
-# Ключ: session_id, Значение: данные пациента
-patient_clinical_data: Dict[str, dict] = {
-    "default": {
-        "risk_factors": [],
-        "patient_name": "Не указано",
-        "pregnancy_week": None
-    }  # Сессия по умолчанию
-}
+# Ключ: session_id, Значение: данные пациента.
+# С cachetools хранилище ограничено по размеру: при переполнении вытесняется сессия, к которой
+# дольше всех не обращались. Активные сессии, включая default, читаются постоянно и не теряются по возрасту
+patient_clinical_data: MutableMapping[str, dict] = (
+    LRUCache(maxsize=CLINICAL_DATA_MAX_SESSIONS) if LRUCache is not None else {}
+)
+patient_clinical_data["default"] = {
+    "risk_factors": [],
+    "patient_name": "Не указано",
+    "pregnancy_week": None
+}  # Сессия по умолчанию
+
+# Данные сессии без клинической информации; общий неизменяемый объект вместо нового {} на каждый промах
+EMPTY_CLINICAL = MappingProxyType({
+    "risk_factors": (),
+    "patient_name": "Не указано",
+    "pregnancy_week": None,
+    "patient_age": None
+})
 
 # ==================== PYDANTIC МОДЕЛИ ====================
 
@@ -93,55 +238,93 @@ class ConnectionManager:
     """
     
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        self.lock = asyncio.Lock()
+        # У каждого клиента своя очередь исходящих сообщений и своя задача-писатель
+        self.active_connections: Dict[WebSocket, asyncio.Queue] = {}
+        self.writer_tasks: Dict[WebSocket, asyncio.Task] = {}
+        # Блокировка не нужна: словари меняются только из цикла событий и без await посередине
     
     async def connect(self, websocket: WebSocket):
         """Принять новое WebSocket соединение"""
         await websocket.accept()
-        async with self.lock:
-            self.active_connections.append(websocket)
+        queue = asyncio.Queue(maxsize=WEBSOCKET_QUEUE_SIZE)
+        self.active_connections[websocket] = queue
+        self.writer_tasks[websocket] = asyncio.create_task(self._writer(websocket, queue))
         logger.info(f"[CONNECTED] WebSocket клиент подключен. Активных подключений: {len(self.active_connections)}")
     
     async def disconnect(self, websocket: WebSocket):
         """Отключить WebSocket соединение"""
-        async with self.lock:
-            if websocket in self.active_connections:
-                self.active_connections.remove(websocket)
+        self.active_connections.pop(websocket, None)
+        task = self.writer_tasks.pop(websocket, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
         logger.info(f"[DISCONNECTED] WebSocket клиент отключен. Активных подключений: {len(self.active_connections)}")
     
+    def has_clients(self) -> bool:
+        """Есть ли хотя бы один подключенный клиент"""
+        return bool(self.active_connections)
+    
     async def broadcast(self, message: dict):
         """Отправить сообщение всем подключенным клиентам"""
-        if not self.active_connections:
+        if not self.has_clients():
             return
         
         # Сериализуем сообщение один раз
         try:
-            json_message = json.dumps(message, default=str)
+            json_message = dumps_message(message)
         except Exception as e:
             logger.error(f"Ошибка сериализации сообщения: {e}")
             return
         
-        # Копируем список соединений для безопасной итерации
-        async with self.lock:
-            connections = self.active_connections.copy()
-        
-        # Отправляем всем клиентам и собираем отключенные соединения
-        disconnected = []
-        for connection in connections:
+        await self.broadcast_raw(json_message)
+    
+    async def broadcast_raw(self, json_message: str):
+        """Отправить всем клиентам уже сериализованное сообщение"""
+        # Только раскладываем по очередям: отправкой занимаются задачи-писатели,
+        # поэтому медленный клиент теряет сообщения, а не тормозит прием данных
+        for queue in list(self.active_connections.values()):
             try:
-                await connection.send_text(json_message)
-            except Exception as e:
-                logger.warning(f"Не удалось отправить сообщение клиенту: {e}")
-                disconnected.append(connection)
-        
-        # Удаляем отключенные соединения
-        for connection in disconnected:
-            await self.disconnect(connection)
+                queue.put_nowait(json_message)
+            except asyncio.QueueFull:
+                logger.warning("Очередь WebSocket клиента переполнена, сообщение пропущено")
+    
+    async def _writer(self, websocket: WebSocket, queue: asyncio.Queue):
+        """Отправлять клиенту сообщения из его очереди"""
+        try:
+            while True:
+                json_message = await queue.get()
+                await asyncio.wait_for(websocket.send_text(json_message), timeout=BROADCAST_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Не удалось отправить сообщение клиенту: {e!r}")
+            await self.disconnect(websocket)
 
 
 # ==================== TCP CLIENT ДЛЯ ЭМУЛЯТОРА ====================
 
+def safe_float_convert(value: Any, field_name: str) -> Optional[float]:
+    """
+    Безопасное преобразование значения в float.
+    Логирует ошибки преобразования.
+    """
+    # Быстрый путь: эмулятор присылает числа, isinstance-проверки для них не нужны
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        pass
+    
+    if isinstance(value, str):
+        # Удаляем пробелы и заменяем запятую на точку
+        try:
+            return float(value.strip().replace(',', '.'))
+        except ValueError as e:
+            logger.error(f"Не удалось преобразовать {field_name}='{value}' в число: {e}")
+            return None
+    
+    logger.warning(f"Неожиданный тип данных для {field_name}: {type(value).__name__}")
+    return None
+
+
 class EmulatorClient:
     """
     TCP клиент для подключения к эмулятору КТГ.
@@ -154,13 +337,17 @@ class EmulatorClient:
         self.reader: Optional[asyncio.StreamReader] = None
         self.writer: Optional[asyncio.StreamWriter] = None
         self.running = False
-        self.db = DBManager()
-        self.last_short_analysis_time = time.time()  # Для краткосрочного анализа
-        self.last_full_analysis_time = time.time()   # Для полного анализа
+        self.db = db_manager
+        # Отсчеты копятся в очереди и пишутся в БД пачками одной фоновой задачей
+        self.db_queue: Optional[asyncio.Queue] = None
+        self.db_flusher_task: Optional[asyncio.Task] = None
         self.short_analysis_interval = 10  # Каждые 10 секунд
         self.full_analysis_interval = 120  # Каждые 2 минуты
         self.current_session_id = "default"
         self.data_counter = 0  # Счетчик полученных данных для отладки
+        # Периодические анализы идут в собственных задачах, независимо от приема отсчетов
+        self.short_analysis_task: Optional[asyncio.Task] = None
+        self.full_analysis_task: Optional[asyncio.Task] = None
     
     async def connect(self) -> bool:
         """Установить соединение с эмулятором"""
@@ -200,34 +387,13 @@ class EmulatorClient:
                 self.reader = None
                 logger.info("[DISCONNECTED] Отключено от эмулятора")
     
-    def safe_float_convert(self, value: Any, field_name: str) -> Optional[float]:
-        """
-        Безопасное преобразование значения в float.
-        Логирует ошибки преобразования.
-        """
-        try:
-            if isinstance(value, (int, float)):
-                return float(value)
-            elif isinstance(value, str):
-                # Удаляем пробелы и заменяем запятую на точку
-                cleaned = value.strip().replace(',', '.')
-                return float(cleaned)
-            else:
-                logger.warning(f"Неожиданный тип данных для {field_name}: {type(value).__name__}")
-                return None
-        except (ValueError, TypeError) as e:
-            logger.error(f"Не удалось преобразовать {field_name}='{value}' в число: {e}")
-            return None
-    
     async def run_short_term_analysis(self):
         """Быстрый анализ для выявления децелераций (каждые 10 секунд)"""
         try:
             MIN_RECORDS_FOR_SHORT_ANALYSIS = 30  # Минимум 30 секунд данных
             
             # Получаем последние 2 минуты данных
-            db = DBManager()
-            recent_records = db.get(limit=120)
-            records_count = len(recent_records)
+            records_count = await asyncio.to_thread(self.db.count_recent, 120)
             
             # Проверяем минимальное количество данных
             if records_count < MIN_RECORDS_FOR_SHORT_ANALYSIS:
@@ -244,28 +410,16 @@ class EmulatorClient:
             
             # Извлекаем информацию о децелерациях
             decelerations = result.get('detected_patterns', [])
-            decel_patterns = []
             
-            for pattern in decelerations:
-                pattern_name = pattern.get('name', '').lower()
-                pattern_type = pattern.get('type', '').lower()
-                
-                # Фильтруем только децелерации
-                if 'децелерация' in pattern_name or 'deceleration' in pattern_type:
-                    decel_patterns.append(pattern)
-            
-            # Проверяем критические паттерны
-            critical_patterns = [
-                'deep_decelerations',
-                'prolonged_decelerations', 
-                'late_decelerations'
+            # Фильтруем только децелерации
+            decel_patterns = [
+                pattern for pattern in decelerations
+                if 'децелерация' in pattern.get('name', '').lower()
+                or 'deceleration' in pattern.get('type', '').lower()
             ]
             
-            has_critical = False
-            for key in critical_patterns:
-                if result.get(key, 0) > 0:
-                    has_critical = True
-                    break
+            # Проверяем критические паттерны
+            has_critical = any(result.get(key, 0) > 0 for key in CRITICAL_PATTERNS)
             
             # Если найдены децелерации, отправляем алерт
             if decel_patterns or has_critical:
@@ -277,7 +431,7 @@ class EmulatorClient:
                     "severity": "high" if has_critical else "medium",
                     "message": f"Обнаружены децелерации ({len(decel_patterns)})",
                     "patterns": decel_patterns,
-                    "timestamp": datetime.now().isoformat(),
+                    "timestamp": now_iso(),
                     "records_analyzed": records_count
                 })
                 
@@ -304,9 +458,7 @@ class EmulatorClient:
             MIN_RECORDS_FOR_FULL_ANALYSIS = 600  # Минимум 10 минут данных для полного анализа
             
             # Получаем количество записей в базе данных
-            db = DBManager()
-            recent_records = db.get(limit=MIN_RECORDS_FOR_FULL_ANALYSIS + 1)
-            records_count = len(recent_records)
+            records_count = await asyncio.to_thread(self.db.count_recent, MIN_RECORDS_FOR_FULL_ANALYSIS + 1)
             
             # Проверяем, достаточно ли данных для полного анализа
             if records_count < MIN_RECORDS_FOR_FULL_ANALYSIS:
@@ -357,7 +509,7 @@ class EmulatorClient:
                 "data": result,
                 "analysis_info": {
                     "records_analyzed": records_count,
-                    "timestamp": datetime.now().isoformat(),
+                    "timestamp": now_iso(),
                     "analysis_type": "full"
                 }
             })
@@ -421,8 +573,8 @@ class EmulatorClient:
             uterus_value_raw = uterus_data[1]  # Значение (может быть строкой или числом)
             
             # Безопасное преобразование значений в float
-            bpm_value = self.safe_float_convert(bpm_value_raw, "bpm_value")
-            uterus_value = self.safe_float_convert(uterus_value_raw, "uterus_value")
+            bpm_value = safe_float_convert(bpm_value_raw, "bpm_value")
+            uterus_value = safe_float_convert(uterus_value_raw, "uterus_value")
             
             # Проверяем успешность преобразования
             if bpm_value is None or uterus_value is None:
@@ -430,73 +582,122 @@ class EmulatorClient:
                 return
             
             # ===== 3. ВАЛИДАЦИЯ ДИАПАЗОНОВ ЗНАЧЕНИЙ =====
-            # Проверка ЧСС (FHR)
-            if bpm_value < 50 or bpm_value > 201:
+            # Проверка ЧСС (FHR); сравнение в таком виде отсекает и NaN
+            if not 50 <= bpm_value <= 201:
                 logger.warning(f"Отфильтровано аномальное значение ЧСС: {bpm_value}")
                 return
             
             # Проверка СДМ (UA)
-            if uterus_value < 0 or uterus_value > 120:
+            if not 0 <= uterus_value <= 120:
                 logger.warning(f"Отфильтровано аномальное значение СДМ: {uterus_value}")
                 return
             
             # ===== 4. СОЗДАНИЕ ВРЕМЕННЫХ МЕТОК =====
+            # ISO-метка строится один раз на секунду и переиспользуется для всех отсчетов этой секунды
             unix_timestamp = int(time.time())
-            iso_timestamp = datetime.now().isoformat()
+            iso_timestamp = iso_from_timestamp(unix_timestamp)
             
             # ===== 5. СОХРАНЕНИЕ В БАЗУ ДАННЫХ =====
             logger.debug(f"[DB] Сохранение в БД: ts={unix_timestamp}, bpm={bpm_value}, uterus={uterus_value}")
             
-            # Используем правильный порядок аргументов для db.add()
-            await asyncio.to_thread(
-                self.db.add,
+            # Порядок полей совпадает с аргументами db.add()
+            self.db_queue.put_nowait((
                 unix_timestamp,      # ts (unix timestamp)
                 bpm_time_str,       # bpm_time (строка времени от эмулятора)
                 bpm_value,          # bpm_value (числовое значение)
                 uterus_time_str,    # uterus_time (строка времени от эмулятора)
                 uterus_value        # uterus_value (числовое значение)
-            )
+            ))
             
-            logger.info(f"[SAVED] Данные сохранены: BPM={bpm_value:.1f}, Uterus={uterus_value:.1f}")
+            logger.info(f"[SAVED] Данные поставлены в очередь записи: BPM={bpm_value:.1f}, Uterus={uterus_value:.1f}")
             
             # ===== 6. ОТПРАВКА ЧЕРЕЗ WEBSOCKET =====
-            ws_message = {
-                "type": "ctg_data",
-                "data": {
-                    "timestamp": iso_timestamp,
-                    "session_id": self.current_session_id,
-                    "bpm_time": bpm_time_str,
-                    "bpm_value": bpm_value,
-                    "uterus_time": uterus_time_str,
-                    "uterus_value": uterus_value,
-                    "data_point": self.data_counter  # Для отладки на фронтенде
-                }
-            }
-            
-            await self.manager.broadcast(ws_message)
-            
-            # ===== 7. ПЕРИОДИЧЕСКИЙ ЗАПУСК АНАЛИЗА =====
-            current_time = time.time()
-            
-            # Краткосрочный анализ (каждые 10 секунд)
-            if current_time - self.last_short_analysis_time >= self.short_analysis_interval:
-                self.last_short_analysis_time = current_time
-                logger.debug("[ANALYSIS] Запуск краткосрочного анализа...")
-                await self.run_short_term_analysis()
-            
-            # Полный анализ (каждые 2 минуты и если достаточно данных)
-            if current_time - self.last_full_analysis_time >= self.full_analysis_interval:
-                self.last_full_analysis_time = current_time
-                logger.info("[ANALYSIS] Запуск полного анализа...")
-                await self.run_full_prediction_analysis(self.current_session_id)
+            # Без подключенных клиентов сообщение даже не собирается
+            if self.manager.has_clients():
+                # Сообщение приходит на каждый отсчет, поэтому собирается по шаблону без сериализации словаря;
+                # строки от эмулятора и id сессии экранируются, числа уже проверены на конечность
+                ws_payload = (
+                    f'{{"type":"ctg_data","data":{{'
+                    f'"timestamp":"{iso_timestamp}",'
+                    f'"session_id":{dumps_message(self.current_session_id)},'
+                    f'"bpm_time":{dumps_message(bpm_time_str)},'
+                    f'"bpm_value":{bpm_value!r},'
+                    f'"uterus_time":{dumps_message(uterus_time_str)},'
+                    f'"uterus_value":{uterus_value!r},'
+                    f'"data_point":{self.data_counter}'  # Для отладки на фронтенде
+                    f'}}}}'
+                )
+                
+                await self.manager.broadcast_raw(ws_payload)
             
         except Exception as e:
             logger.error(f"[CRITICAL] Критическая ошибка в process_data. Данные: {data}. Ошибка: {e}", exc_info=True)
     
+    async def _run_periodically(self, interval: float, analysis):
+        """Вызывать analysis() каждые interval секунд по монотонным часам цикла событий"""
+        # Срок следующего запуска отсчитывается от расписания, а не от конца анализа,
+        # поэтому длительность анализа не сдвигает интервал; пропущенные запуски не копятся
+        loop = asyncio.get_running_loop()
+        next_run = loop.time() + interval
+        while self.running:
+            await asyncio.sleep(max(0.0, next_run - loop.time()))
+            await analysis()
+            next_run = max(next_run + interval, loop.time())
+    
+    async def _short_analysis_loop(self):
+        """Краткосрочный анализ каждые short_analysis_interval секунд"""
+        async def analysis():
+            logger.debug("[ANALYSIS] Запуск краткосрочного анализа...")
+            await self.run_short_term_analysis()
+        await self._run_periodically(self.short_analysis_interval, analysis)
+    
+    async def _full_analysis_loop(self):
+        """Полный анализ каждые full_analysis_interval секунд (если достаточно данных)"""
+        async def analysis():
+            logger.info("[ANALYSIS] Запуск полного анализа...")
+            await self.run_full_prediction_analysis(self.current_session_id)
+        await self._run_periodically(self.full_analysis_interval, analysis)
+    
+    async def _db_flusher(self):
+        """Собирать отсчеты из очереди и записывать их в БД пачками"""
+        # None в очереди - сигнал остановки: текущая пачка дописывается и задача завершается
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            row = await self.db_queue.get()
+            if row is None:
+                return
+            batch = [row]
+            deadline = loop.time() + DB_BATCH_MAX_DELAY
+            while len(batch) < DB_BATCH_MAX_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self.db_queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+            await self._write_batch(batch)
+    
+    async def _write_batch(self, batch: list):
+        try:
+            await asyncio.to_thread(self.db.add_many, batch)
+            logger.debug(f"[DB] Записано отсчетов: {len(batch)}")
+        except Exception as e:
+            logger.error(f"[DB ERROR] Не удалось записать {len(batch)} отсчетов: {e}")
+    
     async def run(self):
         """Основной цикл работы клиента"""
         self.running = True
         logger.info("[START] Запуск EmulatorClient...")
+        self.db_queue = asyncio.Queue()
+        self.db_flusher_task = asyncio.create_task(self._db_flusher())
+        self.short_analysis_task = asyncio.create_task(self._short_analysis_loop())
+        self.full_analysis_task = asyncio.create_task(self._full_analysis_loop())
         
         while self.running:
             try:
@@ -507,36 +708,32 @@ class EmulatorClient:
                     continue
                 
                 # Основной цикл чтения данных
-                buffer = b""  # Буфер для неполных строк
-                
                 while self.running and self.reader:
                     try:
-                        # Читаем данные из сокета с увеличенным таймаутом
-                        chunk = await asyncio.wait_for(
-                            self.reader.read(1024),
+                        # Читаем одну полную строку; неполная остается в буфере StreamReader
+                        line = await asyncio.wait_for(
+                            self.reader.readuntil(b'\n'),
                             timeout=60.0  # Увеличенный таймаут
                         )
                         
-                        if not chunk:
-                            logger.warning("[EMPTY] Получен пустой chunk - соединение закрыто")
-                            break
-                        
-                        # Добавляем к буферу
-                        buffer += chunk
-                        
-                        # Обрабатываем полные строки
-                        while b'\n' in buffer:
-                            line, buffer = buffer.split(b'\n', 1)
-                            if line:
-                                try:
-                                    json_str = line.decode('utf-8').strip()
-                                    if json_str:
-                                        json_data = json.loads(json_str)
-                                        await self.process_data(json_data)
-                                except json.JSONDecodeError as e:
-                                    logger.error(f"[JSON ERROR] Ошибка парсинга JSON: {e}. Строка: {line[:100]}")
-                                except UnicodeDecodeError as e:
-                                    logger.error(f"[DECODE ERROR] Ошибка декодирования: {e}")
+                        line = line.strip()
+                        if line:
+                            try:
+                                # Строка разбирается прямо из bytes, без промежуточного decode
+                                json_data = loads_message(line)
+                                await self.process_data(json_data)
+                            except json.JSONDecodeError as e:
+                                logger.error(f"[JSON ERROR] Ошибка парсинга JSON: {e}. Строка: {line[:100]}")
+                            except UnicodeDecodeError as e:
+                                logger.error(f"[DECODE ERROR] Ошибка декодирования: {e}")
+                    
+                    except asyncio.IncompleteReadError:
+                        logger.warning("[EMPTY] Эмулятор закрыл соединение")
+                        break
+                    
+                    except asyncio.LimitOverrunError as e:
+                        logger.error(f"[READ ERROR] Слишком длинная строка от эмулятора: {e}")
+                        break
                     
                     except asyncio.TimeoutError:
                         logger.warning("[TIMEOUT] Таймаут чтения данных от эмулятора")
@@ -568,10 +765,47 @@ class EmulatorClient:
         logger.info("[STOP] Остановка EmulatorClient...")
         self.running = False
         await self.disconnect()
+        
+        tasks = [task for task in (self.short_analysis_task, self.full_analysis_task) if task is not None]
+        for task in tasks:
+            task.cancel()
+        # Дожидаемся отмены: после stop() lifespan закрывает prediction_service
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.short_analysis_task = self.full_analysis_task = None
+        
+        # Дописываем в БД то, что осталось в очереди
+        if self.db_flusher_task is not None:
+            self.db_queue.put_nowait(None)
+            await self.db_flusher_task
+            self.db_flusher_task = None
 
 
 # ==================== ФОНОВЫЙ ПРОЦЕСС "ПОЧТАЛЬОН" ====================
 
+# Новые архивы передаются отправителю сразу: путь кладется в очередь и будится событие.
+# Полный просмотр папки остается только как периодический повтор неудавшихся отправок
+archive_queue: deque = deque()
+archive_queue_event = asyncio.Event()
+
+
+def enqueue_archive(archive_path: str):
+    """Сообщить фоновому отправителю о новом архиве в очереди"""
+    archive_queue.append(archive_path)
+    archive_queue_event.set()
+
+
+def write_archive(archive_path: str, archive_payload: dict):
+    """Записать архив сессии в папку очереди"""
+    # Архив читает только отправитель, отступы лишь увеличивали время записи и размер файла
+    Path(archive_path).write_bytes(dumps_bytes(archive_payload))
+
+
+def list_queued_archives() -> List[str]:
+    """Пути архивов в очереди в порядке имен (одно чтение каталога, без fnmatch)"""
+    with os.scandir(ARCHIVES_QUEUE_DIR) as entries:
+        return sorted(entry.path for entry in entries if entry.name.endswith('.json') and entry.is_file())
+
+
 async def archive_sender_worker():
     """
     Фоновый процесс для отправки архивов из локальной очереди.
@@ -579,47 +813,56 @@ async def archive_sender_worker():
     """
     logger.info("[ARCHIVE SENDER] Запуск фонового процесса отправки архивов")
     
-    # Создаем папку для очереди, если её нет
-    os.makedirs(ARCHIVES_QUEUE_DIR, exist_ok=True)
-    
-    while True:
-        try:
-            # Получаем список файлов в очереди
-            archive_files = sorted(glob.glob(os.path.join(ARCHIVES_QUEUE_DIR, "*.json")))
-            
-            if archive_files:
-                logger.info(f"[ARCHIVE SENDER] Найдено {len(archive_files)} архивов в очереди")
+    # Один клиент на все время работы: соединения с сервером архивов переиспользуются (keep-alive),
+    # а по HTTP/2 архивы идут одним мультиплексированным соединением
+    async with httpx.AsyncClient(
+        http2=h2 is not None,
+        timeout=ARCHIVE_SEND_TIMEOUT,
+        limits=httpx.Limits(max_connections=10, max_keepalive_connections=4)
+    ) as client:
+        archive_files = None  # None - просмотреть всю папку очереди
+        # Пауза нужна только после неудачи: успешные отправки идут подряд без задержки,
+        # а при недоступном сервере интервал между попытками растет экспоненциально
+        backoff = ARCHIVE_RETRY_BACKOFF_MIN
+        while True:
+            try:
+                # Получаем список файлов в очереди
+                if archive_files is None:
+                    archive_files = await asyncio.to_thread(list_queued_archives)
                 
-                for archive_path in archive_files:
-                    try:
-                        # Читаем архив
-                        with open(archive_path, 'r', encoding='utf-8') as f:
-                            archive_data = json.load(f)
-                        
-                        # Извлекаем URL сервера из метаданных
-                        server_url = archive_data.get('metadata', {}).get('archive_server_url')
-                        
-                        if not server_url:
-                            logger.error(f"[ARCHIVE SENDER] Отсутствует URL сервера в архиве {archive_path}")
-                            # Перемещаем в папку с ошибками
-                            error_dir = os.path.join(ARCHIVES_QUEUE_DIR, "errors")
-                            os.makedirs(error_dir, exist_ok=True)
-                            error_path = os.path.join(error_dir, os.path.basename(archive_path))
-                            os.rename(archive_path, error_path)
-                            continue
-                        
-                        # Подготавливаем данные для отправки (без URL в метаданных)
-                        send_data = archive_data.copy()
-                        if 'metadata' in send_data and 'archive_server_url' in send_data['metadata']:
-                            del send_data['metadata']['archive_server_url']
-                        
-                        logger.info(f"[ARCHIVE SENDER] Попытка отправки архива {os.path.basename(archive_path)} на {server_url}")
-                        
-                        # Пытаемся отправить
-                        async with httpx.AsyncClient(timeout=ARCHIVE_SEND_TIMEOUT) as client:
+                if archive_files:
+                    logger.info(f"[ARCHIVE SENDER] Найдено {len(archive_files)} архивов в очереди")
+                    
+                    for archive_path in archive_files:
+                        failed = True
+                        try:
+                            # Читаем архив
+                            # Файловые операции выполняются в потоке, чтобы не блокировать цикл событий
+                            raw = await asyncio.to_thread(Path(archive_path).read_bytes)
+                            archive_data = loads_message(raw)
+                            
+                            # Извлекаем URL сервера из метаданных
+                            server_url = archive_data.get('metadata', {}).get('archive_server_url')
+                            
+                            if not server_url:
+                                logger.error(f"[ARCHIVE SENDER] Отсутствует URL сервера в архиве {archive_path}")
+                                # Перемещаем в папку с ошибками
+                                error_path = os.path.join(ARCHIVES_ERROR_DIR, os.path.basename(archive_path))
+                                await asyncio.to_thread(os.rename, archive_path, error_path)
+                                backoff = ARCHIVE_RETRY_BACKOFF_MIN
+                                continue
+                            
+                            # Подготавливаем данные для отправки (без URL в метаданных);
+                            # тело сериализуется один раз, архив больше не копируется
+                            archive_data['metadata'].pop('archive_server_url', None)
+                            payload = dumps_bytes(archive_data)
+                            
+                            logger.info(f"[ARCHIVE SENDER] Попытка отправки архива {os.path.basename(archive_path)} на {server_url}")
+                            
+                            # Пытаемся отправить
                             response = await client.post(
                                 server_url,
-                                json=send_data,
+                                content=payload,
                                 headers={"Content-Type": "application/json"}
                             )
                             
@@ -628,10 +871,9 @@ async def archive_sender_worker():
                                 logger.info(f"[ARCHIVE SENDER] ✅ Архив успешно отправлен: {os.path.basename(archive_path)}")
                                 
                                 # Перемещаем в папку успешно отправленных
-                                sent_dir = os.path.join(ARCHIVES_QUEUE_DIR, "sent")
-                                os.makedirs(sent_dir, exist_ok=True)
-                                sent_path = os.path.join(sent_dir, os.path.basename(archive_path))
-                                os.rename(archive_path, sent_path)
+                                sent_path = os.path.join(ARCHIVES_SENT_DIR, os.path.basename(archive_path))
+                                await asyncio.to_thread(os.rename, archive_path, sent_path)
+                                failed = False
                                 
                                 # Уведомляем через WebSocket
                                 await manager.broadcast({
@@ -643,30 +885,44 @@ async def archive_sender_worker():
                                 logger.warning(f"[ARCHIVE SENDER] Сервер вернул код {response.status_code} для {os.path.basename(archive_path)}")
                                 # Оставляем в очереди для повторной попытки
                                 
-                    except httpx.ConnectError:
-                        logger.warning(f"[ARCHIVE SENDER] Нет соединения с сервером для {os.path.basename(archive_path)}")
-                        # Файл остается в очереди
-                    except httpx.TimeoutException:
-                        logger.warning(f"[ARCHIVE SENDER] Таймаут при отправке {os.path.basename(archive_path)}")
-                        # Файл остается в очереди
-                    except Exception as e:
-                        logger.error(f"[ARCHIVE SENDER] Ошибка при обработке {archive_path}: {e}", exc_info=True)
-                        # Файл остается в очереди
-                    
-                    # Небольшая пауза между отправками
-                    await asyncio.sleep(2)
-            else:
-                logger.debug("[ARCHIVE SENDER] Очередь архивов пуста")
+                        except httpx.ConnectError:
+                            logger.warning(f"[ARCHIVE SENDER] Нет соединения с сервером для {os.path.basename(archive_path)}")
+                            # Файл остается в очереди
+                        except httpx.TimeoutException:
+                            logger.warning(f"[ARCHIVE SENDER] Таймаут при отправке {os.path.basename(archive_path)}")
+                            # Файл остается в очереди
+                        except Exception as e:
+                            logger.error(f"[ARCHIVE SENDER] Ошибка при обработке {archive_path}: {e}", exc_info=True)
+                            # Файл остается в очереди
+                        
+                        if failed:
+                            await asyncio.sleep(backoff)
+                            backoff = min(backoff * 2, ARCHIVE_RETRY_BACKOFF_MAX)
+                        else:
+                            backoff = ARCHIVE_RETRY_BACKOFF_MIN
+                else:
+                    logger.debug("[ARCHIVE SENDER] Очередь архивов пуста")
+                
+            except Exception as e:
+                logger.error(f"[ARCHIVE SENDER] Критическая ошибка в цикле отправки: {e}", exc_info=True)
             
-        except Exception as e:
-            logger.error(f"[ARCHIVE SENDER] Критическая ошибка в цикле отправки: {e}", exc_info=True)
-        
-        # Ждем перед следующей проверкой
-        await asyncio.sleep(ARCHIVE_SENDER_INTERVAL)
+            # Ждем нового архива или, по таймауту, повторяем все оставшиеся в папке
+            try:
+                await asyncio.wait_for(archive_queue_event.wait(), timeout=ARCHIVE_SENDER_INTERVAL)
+                archive_queue_event.clear()
+                # Архив мог уже уйти при полном просмотре папки
+                archive_files = [path for path in sorted(set(archive_queue)) if os.path.exists(path)]
+                archive_queue.clear()
+            except asyncio.TimeoutError:
+                archive_files = None
+                archive_queue.clear()
 
 
 # ==================== ИНИЦИАЛИЗАЦИЯ КОМПОНЕНТОВ ====================
 
+# Один DBManager на процесс: соединения с БД открываются один раз и разделяются всеми обработчиками
+db_manager = DBManager(DB_PATH)
+
 manager = ConnectionManager()
 prediction_service = PredictionService(model_path="ml_model.pkl")
 emulator_client = EmulatorClient(manager, prediction_service)
@@ -684,6 +940,10 @@ async def lifespan(app: FastAPI):
     logger.info(f"[ARCHIVES] Папка очереди: {ARCHIVES_QUEUE_DIR}")
     logger.info("=" * 50)
     
+    # Папки очереди создаются один раз при запуске, а не при каждой записи и отправке
+    for directory in (ARCHIVES_QUEUE_DIR, ARCHIVES_ERROR_DIR, ARCHIVES_SENT_DIR):
+        os.makedirs(directory, exist_ok=True)
+    
     # Запускаем фоновые задачи
     emulator_task = asyncio.create_task(emulator_client.run())
     archive_sender_task = asyncio.create_task(archive_sender_worker())  # Новая задача
@@ -699,15 +959,9 @@ async def lifespan(app: FastAPI):
     emulator_task.cancel()
     archive_sender_task.cancel()  # Отменяем задачу почтальона
     
-    try:
-        await emulator_task
-    except asyncio.CancelledError:
-        pass
-    
-    try:
-        await archive_sender_task
-    except asyncio.CancelledError:
-        pass
+    # Задачи завершаются параллельно; CancelledError и прочие ошибки возвращаются, а не пробрасываются
+    await asyncio.gather(emulator_task, archive_sender_task, return_exceptions=True)
+    await prediction_service.close()
 
 
 # ==================== СОЗДАНИЕ FASTAPI ПРИЛОЖЕНИЯ ====================
@@ -716,7 +970,9 @@ app = FastAPI(
     title="Guardian Angel API",
     version="4.2",
     description="Real-time CTG monitoring system with MIS integration",
-    lifespan=lifespan
+    lifespan=lifespan,
+    # Без orjson остается стандартный JSONResponse
+    default_response_class=FastJSONResponse if orjson is not None else JSONResponse
 )
 
 # Настройка CORS
@@ -732,6 +988,7 @@ app.add_middleware(
 # ==================== API ENDPOINTS ====================
 
 @app.get('/')
+@cached_response(STATUS_CACHE_TTL)
 def root():
     """Корневой эндпоинт - статус системы"""
     return {
@@ -748,8 +1005,7 @@ def root():
 def get_ctg_data(limit: int = 50):
     """Получить последние записи КТГ из базы данных"""
     try:
-        db = DBManager()
-        rows = db.get(limit)
+        rows = db_manager.get(limit)
         
         if not rows:
             logger.warning("База данных пуста")
@@ -778,23 +1034,36 @@ def get_ctg_data(limit: int = 50):
 def export_csv():
     """Экспортировать все данные в CSV файл"""
     try:
-        db = DBManager()
-        rows = db.get(sys.maxsize)
+        batches = db_manager.iter_rows(EXPORT_BATCH_SIZE)
+        first_batch = next(batches, None)
         
-        if not rows:
+        if not first_batch:
             raise HTTPException(status_code=404, detail="No data to export")
         
         filename = f'export_{int(time.time())}.csv'
-        path = os.path.join(os.getcwd(), filename)
-        
-        with open(path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['id', 'ts', 'bpm_time', 'bpm_value', 'uterus_time', 'uterus_value'])
-            writer.writerows(rows)
         
-        logger.info(f"Экспортировано {len(rows)} записей в {filename}")
-        return FileResponse(path, media_type='text/csv', filename=filename)
+        def csv_chunks():
+            # CSV отдается по мере чтения из БД, без временного файла и без всех строк в памяти
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(CSV_HEADER)
+            exported = 0
+            for rows in itertools.chain([first_batch], batches):
+                writer.writerows(rows)
+                exported += len(rows)
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate(0)
+            logger.info(f"Экспортировано {exported} записей в {filename}")
+        
+        return StreamingResponse(
+            csv_chunks(),
+            media_type='text/csv',
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при экспорте: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -811,8 +1080,7 @@ async def predictions(session_id: str = "default"):
     """Получить предсказания ML модели с учетом клинических данных"""
     try:
         # Проверяем наличие данных в БД
-        db = DBManager()
-        data_count = len(db.get(100))
+        data_count = await asyncio.to_thread(db_manager.count_recent, 100)
         
         if data_count < 10:
             logger.warning(f"Недостаточно данных для анализа: {data_count} записей")
@@ -840,7 +1108,8 @@ async def predictions(session_id: str = "default"):
         result['risk_factors_used'] = clinical_data.get('risk_factors', []) if clinical_data else []
         result['data_points_analyzed'] = data_count
         
-        return result
+        # fhr_values графика - массив numpy: ответ сериализуется напрямую, без jsonable_encoder
+        return FastJSONResponse(result)
         
     except Exception as e:
         logger.error(f"Ошибка при анализе: {e}", exc_info=True)
@@ -852,7 +1121,7 @@ async def update_clinical_data(session_id: str, payload: ClinicalDataPayload):
     """Загрузить клинические данные пациента (эмуляция МИС)"""
     try:
         clinical_data = payload.dict()
-        clinical_data['last_updated'] = datetime.now().isoformat()
+        clinical_data['last_updated'] = now_iso()
         
         # Сохраняем данные в хранилище
         patient_clinical_data[session_id] = clinical_data
@@ -862,19 +1131,14 @@ async def update_clinical_data(session_id: str, payload: ClinicalDataPayload):
         logger.info(f"  - Срок беременности: {clinical_data.get('pregnancy_week', 'Не указан')} недель")
         logger.info(f"  - Факторов риска: {len(payload.risk_factors)}")
         
-        # Уведомляем через WebSocket об обновлении клинических данных
+        # Уведомляем через WebSocket одним сообщением: клинические данные
+        # и поля информации о пациенте (name/week, как в patient_info_updated)
         await manager.broadcast({
             "type": "clinical_data_updated",
             "session_id": session_id,
-            "data": clinical_data
-        })
-        
-        # Отправляем специальное сообщение об обновлении информации о пациенте
-        await manager.broadcast({
-            "type": "patient_info_updated",
-            "session_id": session_id,
             "name": clinical_data.get('patient_name', 'Не указано'),
-            "week": clinical_data.get('pregnancy_week')
+            "week": clinical_data.get('pregnancy_week'),
+            "data": clinical_data
         })
         
         # Запускаем анализ с новыми данными
@@ -912,14 +1176,9 @@ async def clear_clinical_data(session_id: str):
     if session_id in patient_clinical_data:
         del patient_clinical_data[session_id]
         
+        # Вместе с удалением сообщаем о сбросе информации пациента
         await manager.broadcast({
             "type": "clinical_data_cleared",
-            "session_id": session_id
-        })
-        
-        # Отправляем обновление о сбросе информации пациента
-        await manager.broadcast({
-            "type": "patient_info_updated",
             "session_id": session_id,
             "name": "Не указано",
             "week": None
@@ -979,19 +1238,24 @@ async def load_sample_patients():
     }
     
     for session_id, data in sample_patients.items():
-        data['last_updated'] = datetime.now().isoformat()
+        data['last_updated'] = now_iso()
         patient_clinical_data[session_id] = data
     
     logger.info(f"Загружены демо-данные для {len(sample_patients)} пациентов")
     
-    # Отправляем уведомление о загрузке демо-данных
-    for session_id, data in sample_patients.items():
-        await manager.broadcast({
-            "type": "patient_info_updated",
-            "session_id": session_id,
-            "name": data.get('patient_name', 'Не указано'),
-            "week": data.get('pregnancy_week')
-        })
+    # Отправляем уведомление о загрузке демо-данных одним сообщением на всех пациентов
+    await manager.broadcast({
+        "type": "patients_batch",
+        "updates": [
+            {
+                "type": "patient_info_updated",
+                "session_id": session_id,
+                "name": data.get('patient_name', 'Не указано'),
+                "week": data.get('pregnancy_week')
+            }
+            for session_id, data in sample_patients.items()
+        ]
+    })
     
     return {
         "status": "ok",
@@ -1010,7 +1274,7 @@ async def websocket_endpoint(websocket: WebSocket):
         await websocket.send_json({
             "type": "welcome",
             "message": "Connected to Guardian Angel real-time stream",
-            "server_time": datetime.now().isoformat()
+            "server_time": now_iso()
         })
         
         # Отправляем текущий статус
@@ -1020,24 +1284,15 @@ async def websocket_endpoint(websocket: WebSocket):
             "data_points": emulator_client.data_counter
         })
         
-        # Отправляем информацию о текущем пациенте
+        # Отправляем информацию о текущем пациенте (если данных нет - значения по умолчанию)
         current_session = emulator_client.current_session_id
-        if current_session in patient_clinical_data:
-            patient_data = patient_clinical_data[current_session]
-            await websocket.send_json({
-                "type": "patient_info_updated",
-                "session_id": current_session,
-                "name": patient_data.get('patient_name', 'Не указано'),
-                "week": patient_data.get('pregnancy_week')
-            })
-        else:
-            # Если данных нет, отправляем значения по умолчанию
-            await websocket.send_json({
-                "type": "patient_info_updated",
-                "session_id": current_session,
-                "name": "Не указано",
-                "week": None
-            })
+        patient_data = patient_clinical_data.get(current_session) or EMPTY_CLINICAL
+        await websocket.send_json({
+            "type": "patient_info_updated",
+            "session_id": current_session,
+            "name": patient_data.get('patient_name', 'Не указано'),
+            "week": patient_data.get('pregnancy_week')
+        })
         
         # Держим соединение открытым
         while True:
@@ -1067,8 +1322,8 @@ async def websocket_endpoint(websocket: WebSocket):
                 })
                 
                 # Отправляем информацию о пациенте для новой сессии
-                if new_session in patient_clinical_data:
-                    patient_data = patient_clinical_data[new_session]
+                patient_data = patient_clinical_data.get(new_session)
+                if patient_data is not None:
                     await websocket.send_json({
                         "type": "patient_info_updated",
                         "session_id": new_session,
@@ -1084,11 +1339,11 @@ async def websocket_endpoint(websocket: WebSocket):
 
 
 @app.get('/status')
+@cached_response(STATUS_CACHE_TTL)
 async def get_status():
     """Получить полный статус системы"""
     try:
-        db = DBManager()
-        total_records = len(db.get(sys.maxsize))
+        total_records = await asyncio.to_thread(db_manager.count)
         
         return {
             "system": "Guardian Angel API",
@@ -1110,10 +1365,10 @@ async def get_status():
                 "sessions": list(patient_clinical_data.keys())
             },
             "current_session": emulator_client.current_session_id,
-            "current_patient": patient_clinical_data.get(
-                emulator_client.current_session_id, {}
+            "current_patient": (
+                patient_clinical_data.get(emulator_client.current_session_id) or EMPTY_CLINICAL
             ).get('patient_name', 'Не указано'),
-            "server_time": datetime.now().isoformat()
+            "server_time": now_iso()
         }
     except Exception as e:
         logger.error(f"Ошибка при получении статуса: {e}")
@@ -1123,13 +1378,9 @@ async def get_status():
 @app.get("/session/current")
 async def get_current_session():
     """Получить информацию о текущей сессии"""
-    db = DBManager()
-    record_count = len(db.get(100))
+    record_count = await asyncio.to_thread(db_manager.count_recent, 100)
     
-    clinical_data = patient_clinical_data.get(
-        emulator_client.current_session_id, 
-        {}
-    )
+    clinical_data = patient_clinical_data.get(emulator_client.current_session_id) or EMPTY_CLINICAL
     
     return {
         "session_id": emulator_client.current_session_id,
@@ -1148,21 +1399,20 @@ async def preview_export_data():
     Предпросмотр данных, которые будут архивированы при завершении сессии.
     Полезно для проверки перед финальной архивацией.
     """
-    db = DBManager()
-    all_records = db.get(sys.maxsize)
+    total_records = await asyncio.to_thread(db_manager.count)
     
-    if not all_records:
+    if not total_records:
         return {
             "status": "no_data",
             "message": "No data to preview"
         }
     
-    # Показываем только первые и последние 5 записей для предпросмотра
-    preview_records = []
-    if len(all_records) <= 10:
-        preview_records = all_records
+    # Показываем только первые и последние 5 записей для предпросмотра;
+    # из БД читаются только они, а не весь сеанс
+    if total_records <= 10:
+        preview_records = await asyncio.to_thread(db_manager.get, 10)
     else:
-        preview_records = all_records[:5] + all_records[-5:]
+        preview_records = await asyncio.to_thread(lambda: db_manager.get(5) + db_manager.get_oldest(5))
     
     formatted_preview = []
     for record in preview_records:
@@ -1173,21 +1423,18 @@ async def preview_export_data():
             "uterus_value": record[5]
         })
     
-    clinical_data = patient_clinical_data.get(
-        emulator_client.current_session_id, 
-        {}
-    )
+    clinical_data = patient_clinical_data.get(emulator_client.current_session_id) or EMPTY_CLINICAL
     
     return {
         "session_id": emulator_client.current_session_id,
-        "total_records": len(all_records),
+        "total_records": total_records,
         "patient_info": {
             "name": clinical_data.get("patient_name", "Не указано"),
             "pregnancy_week": clinical_data.get("pregnancy_week"),
             "risk_factors": clinical_data.get("risk_factors", [])
         },
         "data_preview": formatted_preview,
-        "preview_note": f"Showing {len(formatted_preview)} of {len(all_records)} records"
+        "preview_note": f"Showing {len(formatted_preview)} of {total_records} records"
     }
 
 
@@ -1205,13 +1452,11 @@ async def end_session(request: SessionEndRequest):
         logger.info(f"[SESSION END] Завершение сессии {session_id}")
         
         # ===== 1. СБОР ДАННЫХ =====
-        db = DBManager()
-        
         # Получаем статистику перед очисткой
-        stats = db.get_session_statistics() if hasattr(db, 'get_session_statistics') else {}
+        stats = db_manager.get_session_statistics() if hasattr(db_manager, 'get_session_statistics') else {}
         
         # Получаем все записи КТГ
-        all_ctg_records = db.get(sys.maxsize)
+        all_ctg_records = await asyncio.to_thread(db_manager.get, sys.maxsize)
         
         if not all_ctg_records:
             logger.warning("Нет данных для архивации")
@@ -1221,36 +1466,24 @@ async def end_session(request: SessionEndRequest):
                 "session_id": session_id
             }
         
-        # Форматируем записи
-        ctg_data_formatted = []
-        for record in all_ctg_records:
-            ctg_data_formatted.append({
-                "id": record[0],
-                "timestamp": record[1],
-                "bpm_time": record[2],
-                "bpm_value": record[3],
-                "uterus_time": record[4],
-                "uterus_value": record[5]
-            })
+        # Форматируем записи: ключи общие для всех строк, dict собирается из zip без поэлементных присваиваний
+        ctg_data_formatted = [dict(zip(ARCHIVE_RECORD_FIELDS, record)) for record in all_ctg_records]
         
         # Получаем клинические данные
-        clinical_data = patient_clinical_data.get(
-            session_id, 
-            {"risk_factors": [], "patient_name": "Не указано"}
-        )
+        clinical_data = patient_clinical_data.get(session_id) or EMPTY_CLINICAL
         
         # ===== 2. ФОРМИРОВАНИЕ АРХИВА =====
         archive_payload = {
             "session_id": session_id,
             "metadata": {
                 "archive_server_url": request.archive_server_url,  # Сохраняем URL в архив
-                "created_at": datetime.now().isoformat(),
+                "created_at": now_iso(),
                 "doctor_name": request.doctor_name,
                 "session_notes": request.session_notes
             },
             "session_info": {
                 "start_time": ctg_data_formatted[0]["timestamp"] if ctg_data_formatted else None,
-                "end_time": datetime.now().isoformat(),
+                "end_time": now_iso(),
                 "total_records": len(ctg_data_formatted),
                 "duration_seconds": stats.get("duration_seconds", 0),
                 "avg_bpm": stats.get("avg_bpm", 0),
@@ -1268,21 +1501,19 @@ async def end_session(request: SessionEndRequest):
         }
         
         # ===== 3. СОХРАНЕНИЕ В ОЧЕРЕДЬ =====
-        os.makedirs(ARCHIVES_QUEUE_DIR, exist_ok=True)
-        
         # Генерируем уникальное имя файла с timestamp для правильной сортировки
         timestamp = int(time.time() * 1000)  # Миллисекунды для уникальности
         archive_filename = f"archive_{session_id}_{timestamp}.json"
         archive_path = os.path.join(ARCHIVES_QUEUE_DIR, archive_filename)
         
-        # Сохраняем архив
-        with open(archive_path, 'w', encoding='utf-8') as f:
-            json.dump(archive_payload, f, indent=2, default=str)
+        # Сохраняем архив; запись большого файла не должна останавливать цикл событий
+        await asyncio.to_thread(write_archive, archive_path, archive_payload)
         
         logger.info(f"[QUEUE] Архив сохранен в очередь: {archive_filename}")
+        enqueue_archive(archive_path)
         
         # ===== 4. НЕМЕДЛЕННАЯ ОЧИСТКА ДАННЫХ =====
-        cleared_records = db.clear_data()
+        cleared_records = await asyncio.to_thread(db_manager.clear_data)
         logger.info(f"[CLEANUP] Очищено {cleared_records} записей из БД")
         
         # Очищаем клинические данные
@@ -1322,7 +1553,7 @@ async def end_session(request: SessionEndRequest):
         })
         
         # Проверяем статус очереди
-        queue_files = glob.glob(os.path.join(ARCHIVES_QUEUE_DIR, "*.json"))
+        queue_files = await asyncio.to_thread(list_queued_archives)
         
         return {
             "status": "success",
@@ -1348,50 +1579,74 @@ async def end_session(request: SessionEndRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def scan_archives(directory: str) -> list:
+    """Записи *.json каталога; stat() DirEntry берется из уже прочитанного каталога"""
+    try:
+        with os.scandir(directory) as entries:
+            return [entry for entry in entries if entry.name.endswith('.json') and entry.is_file()]
+    except FileNotFoundError:
+        return []
+
+
+# Поля архивов в очереди по пути файла: (mtime, session_id, server_url).
+# Неизмененный файл при повторном опросе очереди не читается и не разбирается заново
+archive_meta_cache: Dict[str, tuple] = {}
+
+
+def read_archive_meta(path: str, mtime: float) -> tuple:
+    cached = archive_meta_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1], cached[2]
+    
+    try:
+        data = loads_message(Path(path).read_bytes())
+        session_id = data.get("session_id", "unknown")
+        server_url = data.get("metadata", {}).get("archive_server_url", "unknown")
+    except Exception:
+        session_id = "error"
+        server_url = "error"
+    
+    archive_meta_cache[path] = (mtime, session_id, server_url)
+    return session_id, server_url
+
+
+def collect_archives_queue() -> tuple:
+    """Детали архивов в очереди и количество архивов с ошибками и отправленных"""
+    pending_entries = sorted(scan_archives(ARCHIVES_QUEUE_DIR), key=lambda entry: entry.name)
+    
+    pending_details = []
+    for entry in pending_entries:
+        file_stat = entry.stat()
+        session_id, server_url = read_archive_meta(entry.path, file_stat.st_mtime)
+        pending_details.append({
+            "filename": entry.name,
+            "session_id": session_id,
+            "server_url": server_url,
+            "size_bytes": file_stat.st_size,
+            "created": datetime.fromtimestamp(file_stat.st_ctime).isoformat()
+        })
+    
+    # Ушедшие из очереди архивы больше не нужны в кеше
+    pending_paths = {entry.path for entry in pending_entries}
+    for path in archive_meta_cache.keys() - pending_paths:
+        del archive_meta_cache[path]
+    
+    errors_count = len(scan_archives(ARCHIVES_ERROR_DIR))
+    sent_count = len(scan_archives(ARCHIVES_SENT_DIR))
+    return pending_details, errors_count, sent_count
+
+
 @app.get("/archives/queue")
 async def get_archives_queue():
     """Получить информацию об очереди архивов"""
     try:
-        # Архивы в очереди
-        pending_files = glob.glob(os.path.join(ARCHIVES_QUEUE_DIR, "*.json"))
-        
-        # Архивы с ошибками
-        error_dir = os.path.join(ARCHIVES_QUEUE_DIR, "errors")
-        error_files = glob.glob(os.path.join(error_dir, "*.json")) if os.path.exists(error_dir) else []
-        
-        # Успешно отправленные
-        sent_dir = os.path.join(ARCHIVES_QUEUE_DIR, "sent")
-        sent_files = glob.glob(os.path.join(sent_dir, "*.json")) if os.path.exists(sent_dir) else []
-        
-        # Детальная информация о файлах в очереди
-        pending_details = []
-        for file_path in sorted(pending_files):
-            file_stat = os.stat(file_path)
-            file_size = file_stat.st_size
-            
-            # Пытаемся прочитать session_id из файла
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    session_id = data.get("session_id", "unknown")
-                    server_url = data.get("metadata", {}).get("archive_server_url", "unknown")
-            except:
-                session_id = "error"
-                server_url = "error"
-            
-            pending_details.append({
-                "filename": os.path.basename(file_path),
-                "session_id": session_id,
-                "server_url": server_url,
-                "size_bytes": file_size,
-                "created": datetime.fromtimestamp(file_stat.st_ctime).isoformat()
-            })
+        pending_details, errors_count, sent_count = await asyncio.to_thread(collect_archives_queue)
         
         return {
             "queue_status": {
-                "pending": len(pending_files),
-                "errors": len(error_files),
-                "sent": len(sent_files)
+                "pending": len(pending_details),
+                "errors": errors_count,
+                "sent": sent_count
             },
             "pending_archives": pending_details,
             "next_check": f"in {ARCHIVE_SENDER_INTERVAL} seconds"
@@ -1407,12 +1662,13 @@ async def retry_archive_send(filename: str):
     """Повторить попытку отправки конкретного архива"""
     try:
         # Проверяем, есть ли файл в папке ошибок
-        error_path = os.path.join(ARCHIVES_QUEUE_DIR, "errors", filename)
+        error_path = os.path.join(ARCHIVES_ERROR_DIR, filename)
         queue_path = os.path.join(ARCHIVES_QUEUE_DIR, filename)
         
         if os.path.exists(error_path):
             # Перемещаем обратно в очередь
-            os.rename(error_path, queue_path)
+            await asyncio.to_thread(os.rename, error_path, queue_path)
+            enqueue_archive(queue_path)
             logger.info(f"[RETRY] Архив {filename} возвращен в очередь")
             
             return {
@@ -1427,19 +1683,22 @@ async def retry_archive_send(filename: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def remove_archives(directory: str) -> int:
+    entries = scan_archives(directory)
+    for entry in entries:
+        os.remove(entry.path)
+    return len(entries)
+
+
 @app.delete("/archives/clear-sent")
 async def clear_sent_archives():
     """Очистить папку с успешно отправленными архивами"""
     try:
-        sent_dir = os.path.join(ARCHIVES_QUEUE_DIR, "sent")
-        if os.path.exists(sent_dir):
-            files = glob.glob(os.path.join(sent_dir, "*.json"))
-            for file in files:
-                os.remove(file)
-            
+        removed = await asyncio.to_thread(remove_archives, ARCHIVES_SENT_DIR)
+        if removed:
             return {
                 "status": "success",
-                "message": f"Cleared {len(files)} sent archives"
+                "message": f"Cleared {removed} sent archives"
             }
         else:
             return {
@@ -1463,5 +1722,9 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=True,
+        loop="uvloop" if uvloop is not None else "asyncio",
+        # Одно и то же сообщение рассылается всем клиентам; permessage-deflate сжимал бы его
+        # заново для каждого соединения, а кадры ctg_data слишком малы, чтобы сжатие окупалось
+        ws_per_message_deflate=False,
         log_level="info"
     )
\ No newline at end of file
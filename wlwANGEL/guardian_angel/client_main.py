@@ -1,18 +1,39 @@
 # client_main.py
 import json
-import socket
 import time
 import os
 import sys
 import asyncio
 import websockets
 
+try:
+    import orjson
+except ImportError:  # без orjson используется стандартный json
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:  # без uvloop работает стандартный цикл событий asyncio
+    uvloop = None
+
 sys.path.append(os.path.dirname(__file__))
 from db_manager import DBManager
 
 HOST = '127.0.0.1'
 PORT = 65432
 
+# Сообщения WebSocket передаются как UTF-8 bytes: json.loads и orjson.loads принимают bytes,
+# поэтому ни на приеме, ни на отправке строка не декодируется и не кодируется повторно
+if orjson is not None:
+    # orjson.JSONDecodeError наследуется от json.JSONDecodeError
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+else:
+    json_loads = json.loads
+
+    def json_dumps(data):
+        return json.dumps(data).encode('utf-8')
+
 def safe_int(x, fallback=None):
     try:
         return int(float(x))
@@ -33,7 +54,10 @@ class WebSocketClient:
         
     async def connect(self):
         try:
-            self.websocket = await websockets.connect('ws://localhost:8000/ws')
+            # Сообщения маленькие и частые: сжатие только тратит CPU на каждое сообщение,
+            # а ping клиента не нужен - соединение локальное, обрыв обнаруживается по ошибке отправки
+            self.websocket = await websockets.connect('ws://localhost:8000/ws', compression=None,
+                                                      max_queue=None, ping_interval=None)
             self.is_connected = True
             print("✅ WebSocket connected to API")
             
@@ -46,12 +70,17 @@ class WebSocketClient:
             
     async def listen_messages(self):
         try:
-            async for message in self.websocket:
-                data = json.loads(message)
+            while True:
+                # decode=False отдает кадр как bytes, без проверки и декодирования UTF-8
+                message = await self.websocket.recv(decode=False)
+                data = json_loads(message)
                 if data.get("type") == "pong":
                     print("🏓 Received pong from server")
                 elif data.get("type") == "connection":
                     print(f"🔗 {data.get('message')}")
+        except websockets.ConnectionClosedOK:
+            # Штатное закрытие: так же, как раньше при завершении async for
+            pass
         except Exception as e:
             print(f"Error in WebSocket listener: {e}")
             self.is_connected = False
@@ -59,7 +88,8 @@ class WebSocketClient:
     async def send_data(self, data):
         if self.is_connected and self.websocket:
             try:
-                await self.websocket.send(json.dumps(data))
+                # bytes отправляются текстовым кадром: сервер читает receive_text()
+                await self.websocket.send(json_dumps(data), text=True)
                 return True
             except Exception as e:
                 print(f"Error sending WebSocket data: {e}")
@@ -81,62 +111,62 @@ async def start_receive():
     # Подключаемся к WebSocket
     await ws_client.connect()
     
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.connect((HOST, PORT))
-        buffer = ''
-        print(f"✅ Connected to data server {HOST}:{PORT}")
-        
+    reader, writer = await asyncio.open_connection(HOST, PORT)
+    print(f"✅ Connected to data server {HOST}:{PORT}")
+    try:
         while True:
-            data = s.recv(4096)
-            if not data:
+            # Чтение строки ждет данных без блокировки цикла событий: listener WebSocket
+            # и отправка продолжают работать, пока сервер данных молчит
+            try:
+                line = await reader.readuntil(b'\n')
+            except asyncio.IncompleteReadError:
                 print("❌ Connection closed by server")
                 break
+            if not line.strip():
+                continue
                 
-            buffer += data.decode('utf-8', errors='ignore')
-            while '\n' in buffer:
-                line, buffer = buffer.split('\n', 1)
-                if not line.strip():
-                    continue
-                    
-                try:
-                    data_json = json.loads(line)
-                    ts = int(time.time())
-                    
-                    # Извлекаем данные ЧСС и СДМ
-                    bpm = data_json.get('bpm', [None, None])
-                    uterus = data_json.get('uterus', [None, None])
-                    
-                    bpm_time = safe_float(bpm[0], fallback=None)
-                    bpm_value = safe_float(bpm[1], fallback=None)
-                    uterus_time = safe_float(uterus[0], fallback=None)
-                    uterus_value = safe_float(uterus[1], fallback=None)
-                    
-                    # Сохраняем в базу данных
-                    db.add(ts, bpm_time, bpm_value, uterus_time, uterus_value)
-                    
-                    # Подготавливаем данные для WebSocket
-                    ws_data = {
-                        "type": "ctg_data",
-                        "ts": ts,
-                        "bpm_value": bpm_value,
-                        "uterus_value": uterus_value,
-                        "bpm_time": bpm_time,
-                        "uterus_time": uterus_time
-                    }
-                    
-                    # Отправляем через WebSocket
-                    success = await ws_client.send_data(ws_data)
+            try:
+                data_json = json_loads(line)
+                ts = int(time.time())
+                
+                # Извлекаем данные ЧСС и СДМ
+                bpm = data_json.get('bpm', [None, None])
+                uterus = data_json.get('uterus', [None, None])
+                
+                bpm_time = safe_float(bpm[0], fallback=None)
+                bpm_value = safe_float(bpm[1], fallback=None)
+                uterus_time = safe_float(uterus[0], fallback=None)
+                uterus_value = safe_float(uterus[1], fallback=None)
+                
+                # Сохраняем в базу данных; при заполнении буфера add() пишет пачку в SQLite,
+                # поэтому вызов идет в пуле потоков и не останавливает цикл событий
+                await asyncio.to_thread(db.add, ts, bpm_time, bpm_value, uterus_time, uterus_value)
+                
+                # Подготавливаем данные для WebSocket
+                ws_data = {
+                    "type": "ctg_data",
+                    "ts": ts,
+                    "bpm_value": bpm_value,
+                    "uterus_value": uterus_value,
+                    "bpm_time": bpm_time,
+                    "uterus_time": uterus_time
+                }
+                
+                # Отправляем через WebSocket
+                success = await ws_client.send_data(ws_data)
+                
+                if success:
+                    print(f"📨 Sent: FHR={bpm_value}, UA={uterus_value}")
+                else:
+                    print(f"💾 Saved: FHR={bpm_value}, UA={uterus_value} (WebSocket offline)")
                     
-                    if success:
-                        print(f"📨 Sent: FHR={bpm_value}, UA={uterus_value}")
-                    else:
-                        print(f"💾 Saved: FHR={bpm_value}, UA={uterus_value} (WebSocket offline)")
-                        
-                except json.JSONDecodeError as e:
-                    print(f"❌ JSON decode error: {e}")
-                    print(f"Raw data: {line}")
-                except Exception as e:
-                    print(f"❌ Error processing message: {e}")
+            except json.JSONDecodeError as e:
+                print(f"❌ JSON decode error: {e}")
+                print(f"Raw data: {line}")
+            except Exception as e:
+                print(f"❌ Error processing message: {e}")
+    finally:
+        writer.close()
 
 async def main():
     try:
@@ -157,5 +187,8 @@ async def main():
         print("👋 Receiver stopped")
 
 if __name__ == '__main__':
-    # Запускаем асинхронный main
-    asyncio.run(main())
\ No newline at end of file
+    # Запускаем асинхронный main; с uvloop цикл событий работает на libuv
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
\ No newline at end of file
@@ -4,8 +4,28 @@ import time
 import os
 
 
+INSERT_SQL = "INSERT INTO ctg_data (ts, bpm_time, bpm_value, uterus_time, uterus_value) VALUES (?, ?, ?, ?, ?)"
+# Тексты запросов неизменны: sqlite3 находит их в кеше подготовленных выражений соединения
+# и не разбирает SQL заново, меняются только параметры
+SELECT_LATEST_SQL = "SELECT id, ts, bpm_time, bpm_value, uterus_time, uterus_value FROM ctg_data ORDER BY id DESC LIMIT ?"
+SELECT_OLDEST_SQL = "SELECT id, ts, bpm_time, bpm_value, uterus_time, uterus_value FROM ctg_data ORDER BY id ASC LIMIT ?"
+SELECT_ALL_SQL = "SELECT id, ts, bpm_time, bpm_value, uterus_time, uterus_value FROM ctg_data ORDER BY id DESC"
+MMAP_SIZE = 256 * 1024 * 1024
+
+
+def configure_connection(conn):
+    # В WAL режиме synchronous=NORMAL безопасен и убирает fsync на каждый commit;
+    # эти настройки действуют только в пределах соединения
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-4000")
+    # Страницы файла БД читаются через отображение в память, без системного вызова read на каждую
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    return conn
+
+
 class DBManager:
-    def __init__(self, db_path=None, flush_interval_seconds=5, max_buffer=50):
+    def __init__(self, db_path=None, flush_interval_seconds=5, max_buffer=500):
         if db_path is None:
             db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'guardian_angel_data.db')
         self.db_path = db_path
@@ -13,67 +33,114 @@ class DBManager:
         self.max_buffer = max_buffer
         self.buffer = []
         self.lock = threading.Lock()
+        # Соединения открываются один раз на все время работы. Запросы приходят из разных потоков
+        # (поток сброса буфера, пул потоков API), поэтому check_same_thread=False; записи
+        # сериализуются write_lock, а читатель в WAL режиме не ждет завершения записи
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        self.write_lock = threading.Lock()
+        self._write_conn = self.get_conn(isolation_level=None, check_same_thread=False)
         self._ensure_db()
+        self._read_conn = self.get_conn(check_same_thread=False)
         self.stop_event = threading.Event()
         self.thread = threading.Thread(target=self._flusher, daemon=True)
         self.thread.start()
 
     def _ensure_db(self):
-        dirpath = os.path.dirname(self.db_path) or '.'
-        os.makedirs(dirpath, exist_ok=True)
-        conn = self.get_conn()
-        try:
-            cur = conn.cursor()
-            cur.execute('''
-            CREATE TABLE IF NOT EXISTS ctg_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ts INTEGER,
-                bpm_time REAL,
-                bpm_value REAL,
-                uterus_time REAL,
-                uterus_value REAL
-            )
-            ''')
-            conn.commit()
-        finally:
-            conn.close()
+        conn = self._write_conn
+        # WAL сохраняется в файле БД: читатели не блокируются записью, commit не ждет fsync
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS ctg_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts INTEGER,
+            bpm_time REAL,
+            bpm_value REAL,
+            uterus_time REAL,
+            uterus_value REAL
+        )
+        ''')
 
     def add(self, ts, bpm_time, bpm_value, uterus_time, uterus_value):
         with self.lock:
             self.buffer.append((ts, bpm_time, bpm_value, uterus_time, uterus_value))
-            if len(self.buffer) >= self.max_buffer:
-                self._flush()
+            if len(self.buffer) < self.max_buffer:
+                return
+            data_to_write = self._take_buffer_locked()
+        # Запись идет уже без self.lock: add() из других потоков не ждет executemany
+        self._insert(data_to_write)
+
+    def add_many(self, rows):
+        # Пачка, уже собранная вызывающей стороной, пишется сразу одной транзакцией
+        if not rows:
+            return
+        self._insert(rows)
 
     def get(self, limit=50):
-        conn = self.get_conn()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT id, ts, bpm_time, bpm_value, uterus_time, uterus_value FROM ctg_data ORDER BY id DESC LIMIT ?",
-            (limit,))
-        rows = cur.fetchall()
-        conn.close()
+        return self._read_conn.execute(SELECT_LATEST_SQL, (limit,)).fetchall()
+
+    def count(self):
+        return self._read_conn.execute("SELECT COUNT(*) FROM ctg_data").fetchone()[0]
+
+    def get_oldest(self, limit=50):
+        # Самые старые записи, но в том же порядке (новые первыми), что и get()
+        rows = self._read_conn.execute(SELECT_OLDEST_SQL, (limit,)).fetchall()
+        rows.reverse()
         return rows
 
-    def get_conn(self):
-        return sqlite3.connect(self.db_path, timeout=10)
+    def count_recent(self, limit):
+        # Количество записей, но не больше limit: строки не выбираются, SQLite останавливается на limit
+        cur = self._read_conn.execute("SELECT COUNT(*) FROM (SELECT 1 FROM ctg_data LIMIT ?)", (limit,))
+        return cur.fetchone()[0]
 
-    def _flush(self):
-        with self.lock:
-            if not self.buffer:
-                return
-            data_to_write = self.buffer[:]
-            self.buffer.clear()
-        conn = self.get_conn()
+    def clear_data(self):
+        # Удаляет все записи КТГ и возвращает их количество
+        with self.write_lock:
+            return self._write_conn.execute("DELETE FROM ctg_data").rowcount
+
+    def iter_rows(self, batch_size=5000):
+        # Все записи пачками по batch_size, в том же порядке, что и get(); строки не собираются в память целиком.
+        # Длинное чтение идет по отдельному соединению, чтобы не держать открытый курсор на общем читателе;
+        # генератор может продолжаться в другом потоке (StreamingResponse), поэтому check_same_thread=False
+        conn = self.get_conn(check_same_thread=False)
         try:
             cur = conn.cursor()
-            cur.executemany(
-                "INSERT INTO ctg_data (ts, bpm_time, bpm_value, uterus_time, uterus_value) VALUES (?, ?, ?, ?, ?)",
-                data_to_write
-            )
-            conn.commit()
+            cur.execute(SELECT_ALL_SQL)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield rows
         finally:
             conn.close()
 
+    def get_conn(self, **kwargs):
+        return configure_connection(sqlite3.connect(self.db_path, timeout=10, **kwargs))
+
+    def _insert(self, rows):
+        # Соединение писателя в autocommit режиме, поэтому транзакция пачки задается явно
+        with self.write_lock:
+            conn = self._write_conn
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(INSERT_SQL, rows)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _take_buffer_locked(self):
+        # Вызывается под self.lock: буфер отдается целиком и заменяется новым списком, без копирования
+        data_to_write = self.buffer
+        self.buffer = []
+        return data_to_write
+
+    def _flush(self):
+        with self.lock:
+            if not self.buffer:
+                return
+            data_to_write = self._take_buffer_locked()
+        self._insert(data_to_write)
+
     def _flusher(self):
         while not self.stop_event.is_set():
             time.sleep(self.flush_interval_seconds)
@@ -82,3 +149,6 @@ class DBManager:
     def stop(self):
         self.stop_event.set()
         self._flush()
+        with self.write_lock:
+            self._write_conn.close()
+        self._read_conn.close()
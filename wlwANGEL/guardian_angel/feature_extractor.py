@@ -1,7 +1,7 @@
 import numpy as np
 import pandas as pd
 from scipy import signal
-from scipy.stats import skew, kurtosis
+from numpy.lib.stride_tricks import sliding_window_view
 from typing import Dict
 class CTGFeatureExtractor:
     """Класс для извлечения признаков из окон КТГ"""
@@ -10,6 +10,9 @@ class CTGFeatureExtractor:
         self.window_size_min = window_size_min
         self.sampling_rate = sampling_rate
         self.window_size_samples = window_size_min * 60 * sampling_rate
+        # Буферы под булевы маски паттернов, создаются при первом вызове и переиспользуются между окнами
+        self._mask_buf = None
+        self._decel_mask_buf = None
         
     def extract_features(self, fhr: np.ndarray, uc: np.ndarray) -> Dict[str, float]:
         """
@@ -30,13 +33,13 @@ class CTGFeatureExtractor:
             fhr_clean = fhr  # Используем исходные данные
         
         # === Базовые статистики ЧСС ===
-        features['fhr_mean'] = np.mean(fhr_clean) if len(fhr_clean) > 0 else np.mean(fhr)
-        features['fhr_std'] = np.std(fhr_clean) if len(fhr_clean) > 0 else np.std(fhr)
-        features['fhr_min'] = np.min(fhr_clean) if len(fhr_clean) > 0 else np.min(fhr)
-        features['fhr_max'] = np.max(fhr_clean) if len(fhr_clean) > 0 else np.max(fhr)
-        features['fhr_median'] = np.median(fhr_clean) if len(fhr_clean) > 0 else np.median(fhr)
-        features['fhr_q25'] = np.percentile(fhr_clean, 25) if len(fhr_clean) > 0 else np.percentile(fhr, 25)
-        features['fhr_q75'] = np.percentile(fhr_clean, 75) if len(fhr_clean) > 0 else np.percentile(fhr, 75)
+        stats_fhr = fhr_clean if len(fhr_clean) > 0 else fhr
+        features['fhr_mean'] = np.mean(stats_fhr)
+        features['fhr_std'] = np.std(stats_fhr)
+        # Все порядковые статистики за один вызов percentile (одно разбиение массива);
+        # 0-й и 100-й перцентили точно равны min и max, 50-й - медиане
+        (features['fhr_min'], features['fhr_q25'], features['fhr_median'],
+         features['fhr_q75'], features['fhr_max']) = np.percentile(stats_fhr, [0, 25, 50, 75, 100])
         features['fhr_iqr'] = features['fhr_q75'] - features['fhr_q25']
         
         # === Вариабельность ===
@@ -45,12 +48,12 @@ class CTGFeatureExtractor:
         features['stv'] = np.mean(np.abs(fhr_diff)) if len(fhr_diff) > 0 else 0
         
         # Long term variability (LTV) - стандартное отклонение в минутных интервалах
-        minute_samples = 60 * self.sampling_rate
+        minute_samples = int(60 * self.sampling_rate)
         if len(fhr) >= minute_samples:
-            minute_means = []
-            for i in range(0, len(fhr) - minute_samples + 1, minute_samples):
-                minute_means.append(np.mean(fhr[i:i+minute_samples]))
-            features['ltv'] = np.std(minute_means) if len(minute_means) > 1 else 0
+            # Полные минуты - строки матрицы, средние считаются одной редукцией; неполная минута в конце не учитывается
+            n_minutes = len(fhr) // minute_samples
+            minute_means = fhr[:n_minutes * minute_samples].reshape(n_minutes, minute_samples).mean(axis=1)
+            features['ltv'] = np.std(minute_means) if n_minutes > 1 else 0
         else:
             features['ltv'] = features['fhr_std']
             
@@ -59,18 +62,19 @@ class CTGFeatureExtractor:
         
         # Акселерации (подъемы > 15 уд/мин от baseline длительностью > 15 сек)
         accel_threshold = baseline + 15
-        accel_mask = fhr > accel_threshold
+        mask_buf, decel_mask_buf = self._get_mask_buffers(len(fhr))
+        accel_mask = np.greater(fhr, accel_threshold, out=mask_buf)
         features['accelerations_count'] = self._count_episodes(accel_mask, min_duration_sec=15)
-        features['accelerations_time_ratio'] = np.sum(accel_mask) / len(fhr)
+        features['accelerations_time_ratio'] = np.count_nonzero(accel_mask) / len(fhr)
         
         # Децелерации (снижения > 15 уд/мин от baseline)
         decel_threshold = baseline - 15
-        decel_mask = fhr < decel_threshold
+        decel_mask = np.less(fhr, decel_threshold, out=decel_mask_buf)
         features['decelerations_count'] = self._count_episodes(decel_mask, min_duration_sec=15)
-        features['decelerations_time_ratio'] = np.sum(decel_mask) / len(fhr)
+        features['decelerations_time_ratio'] = np.count_nonzero(decel_mask) / len(fhr)
         
-        # Глубокие децелерации (> 30 уд/мин)
-        deep_decel_mask = fhr < (baseline - 30)
+        # Глубокие децелерации (> 30 уд/мин); маска акселераций уже не нужна, ее буфер переиспользуется
+        deep_decel_mask = np.less(fhr, baseline - 30, out=mask_buf)
         features['deep_decelerations_count'] = self._count_episodes(deep_decel_mask, min_duration_sec=10)
         
         # Пролонгированные децелерации (> 90 сек)
@@ -87,7 +91,7 @@ class CTGFeatureExtractor:
         
         # Детекция пиков схваток
         if len(uc) > 20:
-            uc_smooth = signal.medfilt(uc, kernel_size=5)
+            uc_smooth = self._median_filter(uc, kernel_size=5)
             peaks, _ = signal.find_peaks(uc_smooth, height=np.percentile(uc_smooth, 75), distance=30*self.sampling_rate)
             features['uc_peak_count'] = len(peaks)
             features['uc_peak_rate_per_10min'] = len(peaks) * (10 / self.window_size_min)
@@ -100,39 +104,72 @@ class CTGFeatureExtractor:
         features['fhr_entropy'] = self._calculate_entropy(fhr_clean)
         
         # Асимметрия и эксцесс
-        features['fhr_skewness'] = skew(fhr_clean) if len(fhr_clean) > 0 else 0
-        features['fhr_kurtosis'] = kurtosis(fhr_clean) if len(fhr_clean) > 0 else 0
+        # fhr_mean посчитан по тому же fhr_clean (stats_fhr), когда он не пуст
+        if len(fhr_clean) > 0:
+            features['fhr_skewness'], features['fhr_kurtosis'] = self._skew_kurtosis(fhr_clean, features['fhr_mean'])
+        else:
+            features['fhr_skewness'] = features['fhr_kurtosis'] = 0
         
         # Процент потерянного сигнала
         features['signal_loss_ratio'] = 1 - (len(fhr_clean) / len(fhr))
         
         return features
     
+    def _get_mask_buffers(self, n: int):
+        """Буферы масок длины n; при окне длиннее прежних буферы пересоздаются"""
+        if self._mask_buf is None or len(self._mask_buf) < n:
+            size = max(n, self.window_size_samples)
+            self._mask_buf = np.empty(size, dtype=bool)
+            self._decel_mask_buf = np.empty(size, dtype=bool)
+        return self._mask_buf[:n], self._decel_mask_buf[:n]
+    
+    def _median_filter(self, x: np.ndarray, kernel_size: int) -> np.ndarray:
+        """Медианный фильтр, совпадающий с signal.medfilt: края дополняются нулями"""
+        half = kernel_size // 2
+        windows = sliding_window_view(np.pad(x, half), kernel_size)
+        # Медиане нужен только средний элемент окна, полная сортировка не требуется
+        return np.partition(windows, half, axis=1)[:, half]
+    
+    def _skew_kurtosis(self, x: np.ndarray, mean: float):
+        """Асимметрия и эксцесс (по Фишеру) со смещением, как scipy.stats.skew/kurtosis по умолчанию"""
+        d = x - mean
+        d2 = d * d
+        m2 = np.mean(d2)
+        # Как и в scipy, для практически постоянного сигнала моменты не определены
+        if m2 <= (np.finfo(d.dtype).eps * mean) ** 2:
+            return np.nan, np.nan
+        return np.mean(d2 * d) / m2 ** 1.5, np.mean(d2 * d2) / (m2 * m2) - 3.0
+    
     def _count_episodes(self, mask: np.ndarray, min_duration_sec: int) -> int:
         """Подсчет эпизодов с минимальной длительностью"""
         min_samples = min_duration_sec * self.sampling_rate
-        episodes = 0
-        current_episode_length = 0
-        
-        for val in mask:
-            if val:
-                current_episode_length += 1
-            else:
-                if current_episode_length >= min_samples:
-                    episodes += 1
-                current_episode_length = 0
-                
-        # Проверяем последний эпизод
-        if current_episode_length >= min_samples:
-            episodes += 1
-            
-        return episodes
+        # Границы эпизодов - места смены значения маски; False по краям закрывает эпизоды в начале и в конце окна
+        padded = np.concatenate(([0], np.asarray(mask, dtype=np.int8), [0]))
+        edges = np.flatnonzero(np.diff(padded))
+        lengths = edges[1::2] - edges[::2]
+        return int(np.count_nonzero(lengths >= min_samples))
     
     def _calculate_entropy(self, signal: np.ndarray, bins: int = 10) -> float:
         """Вычисление энтропии Шеннона"""
         if len(signal) == 0:
             return 0
-        hist, _ = np.histogram(signal, bins=bins)
+        # Равные интервалы по размаху данных, как у np.histogram: номер интервала считается
+        # одним линейным проходом, максимум попадает в последний интервал
+        low, high = float(np.min(signal)), float(np.max(signal))
+        if high > low:
+            # Границы в той же точности, что у np.histogram: float32 для float32, float64 для целых
+            edges_dtype = np.result_type(low, high, signal)
+            if np.issubdtype(edges_dtype, np.integer):
+                edges_dtype = np.result_type(edges_dtype, float)
+            edges = np.linspace(low, high, bins + 1, dtype=edges_dtype)
+            idx = ((signal - low) / (high - low) * bins).astype(np.intp)
+            np.minimum(idx, bins - 1, out=idx)
+            # Поправка на округление у границ интервалов, та же, что в np.histogram
+            idx -= signal < edges[idx]
+            idx += (signal >= edges[idx + 1]) & (idx != bins - 1)
+        else:
+            idx = np.zeros(len(signal), dtype=np.intp)
+        hist = np.bincount(idx, minlength=bins)
         hist = hist[hist > 0]  # Убираем нулевые бины
         if len(hist) == 0:
             return 0
@@ -16,9 +16,55 @@ import logging
 from typing import Dict, Any, List, Tuple, Optional
 from datetime import datetime, timedelta
 from scipy import signal as scipy_signal
-from scipy.stats import skew, kurtosis
-from scipy.interpolate import interp1d
 import warnings
+from types import MappingProxyType
+from itertools import repeat
+from collections import deque
+from enum import IntFlag
+
+try:
+    from numba import njit
+except ImportError:  # без numba разметка аномалий для графика считается векторно в numpy
+    njit = None
+
+try:
+    import onnxruntime as ort
+except ImportError:  # без onnxruntime модель применяется напрямую через sklearn
+    ort = None
+
+try:
+    from skl2onnx import convert_sklearn, update_registered_converter
+    from skl2onnx.common.data_types import FloatTensorType
+    from skl2onnx.common.shape_calculator import calculate_linear_classifier_output_shapes
+except ImportError:  # без skl2onnx используется только уже экспортированный .onnx файл
+    convert_sklearn = None
+
+try:
+    from xgboost import XGBClassifier
+    from onnxmltools.convert.xgboost.operator_converters.XGBoost import convert_xgboost
+except ImportError:  # без xgboost и onnxmltools модель XGBoost в ONNX не экспортируется
+    XGBClassifier = None
+
+# Имя выхода с вероятностями классов в графе, собранном convert_sklearn с zipmap=False
+ONNX_PROBABILITIES_OUTPUT = 'probabilities'
+_onnx_converters_registered = False
+
+
+def _register_onnx_converters():
+    # skl2onnx знает только оценщики sklearn; конвертер XGBClassifier из onnxmltools регистрируется один раз
+    global _onnx_converters_registered
+    if _onnx_converters_registered or XGBClassifier is None:
+        return
+    update_registered_converter(
+        XGBClassifier, 'XGBoostXGBClassifier',
+        calculate_linear_classifier_output_shapes, convert_xgboost,
+        options={'nocl': [True, False], 'zipmap': [True, False, 'columns']})
+    _onnx_converters_registered = True
+
+try:
+    import orjson
+except ImportError:  # без orjson результат анализа сохраняется через стандартный json
+    orjson = None
 
 warnings.filterwarnings('ignore')
 
@@ -56,6 +102,174 @@ SHORT_WINDOW_SAMPLES = int(SHORT_WINDOW_MINUTES * 60 * TARGET_SAMPLING_RATE)
 SHORT_PATTERN_MIN_DURATION = 5 * TARGET_SAMPLING_RATE
 SHORT_PROLONGED_DURATION = 30 * TARGET_SAMPLING_RATE
 ANALYSIS_INTERVAL_SECONDS = 15
+ANALYSIS_HISTORY_SIZE = 100
+# Точность массивов при расчете признаков: float32 вдвое сокращает объем данных на каждом проходе,
+# а для ЧСС и схваток ее с запасом хватает. Сами признаки отдаются как float Python
+FEATURE_DTYPE = np.float32
+# Запросы предсказания, пришедшие в пределах окна, считаются моделью одним вызовом
+PREDICTION_BATCH_WINDOW_SECONDS = 0.02
+PREDICTION_BATCH_MAX_SIZE = 64
+# Результаты анализа пишутся в БД пачками: одна транзакция на все строки, накопленные за окно
+ANALYSIS_SAVE_BATCH_WINDOW_SECONDS = 0.5
+ANALYSIS_SAVE_BATCH_MAX_SIZE = 64
+
+BRADY_THRESHOLD = 110
+TACHY_THRESHOLD = 160
+SEVERE_TACHY_THRESHOLD = 170
+# Типы зон графика по коду разметки (0 - нет аномалии) и их тяжесть; тяжесть брадикардии
+# уточняется по значению ЧСС в начале зоны
+GRAPH_ZONE_TYPES = (None, 'signal_loss', 'bradycardia', 'severe_tachycardia', 'tachycardia',
+                    'acceleration', 'deep_deceleration', 'deceleration')
+GRAPH_ZONE_SEVERITIES = (None, 'warning', 'high', 'critical', 'high', 'good', 'critical', 'high')
+# Цвета зон графика по типу аномалии; неизвестный тип рисуется желтым
+ANOMALY_COLORS = MappingProxyType({
+    'acceleration': '#00ff00',
+    'normal': '#90ee90',
+    'deceleration': '#ff6b6b',
+    'deep_deceleration': '#cc0000',
+    'bradycardia': '#800020',
+    'tachycardia': '#ff9500',
+    'severe_tachycardia': '#ff4500',
+    'signal_loss': '#808080',
+    'unknown': '#ffff00'
+})
+DEFAULT_ANOMALY_COLOR = '#ffff00'
+# Названия клинических паттернов для отчета
+_PATTERN_TRANSLATIONS = MappingProxyType({
+    'prolonged_deceleration': 'Пролонгированная децелерация',
+    'repeated_deep_decelerations': 'Повторные глубокие децелерации',
+    'reduced_variability': 'Сниженная вариабельность',
+    'absent_accelerations': 'Отсутствие акселераций',
+    'bradycardia': 'Брадикардия',
+    'tachycardia': 'Тахикардия',
+    'poor_signal_quality': 'Низкое качество сигнала'
+})
+# Веса вероятности гипоксии и шкалы Фишера в FWBS: для экспертных правил и для ML модели,
+# с готовыми подписями для отчета
+FWBS_RULES_WEIGHTS = (0.7, 0.3)
+FWBS_ML_WEIGHTS = (0.6, 0.2)
+FWBS_WEIGHT_LABELS = MappingProxyType({
+    weight: f'{weight * 100:.0f}%' for weight in FWBS_RULES_WEIGHTS + FWBS_ML_WEIGHTS
+})
+
+
+class RiskFlag(IntFlag):
+    """Факторы риска экспертных правил, влияющие на FWBS; текст для интерфейса остается в risk_factors"""
+    NONE = 0
+    CRITICAL_BRADYCARDIA = 1
+    MARKED_TACHYCARDIA = 2
+    REDUCED_VARIABILITY = 4
+
+
+# Полный результат анализа хранится в TEXT столбце full_result
+if orjson is not None:
+    def dumps_result(result: Dict[str, Any]) -> str:
+        return orjson.dumps(result, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode('utf-8')
+else:
+    def dumps_result(result: Dict[str, Any]) -> str:
+        # Массивы numpy (fhr_values графика) сохраняются списком чисел, как и в orjson
+        return json.dumps(result, default=lambda value: value.tolist())
+
+# Записи КТГ из БД: столбцы запроса SELECT_RECENT_CTG_SQL как поля структурированного массива
+CTG_RECORD_DTYPE = np.dtype([('ts', 'f8'), ('time_sec', 'f8'), ('fhr', 'f8'), ('uc', 'f8')])
+SELECT_RECENT_CTG_SQL = """
+SELECT ts, bpm_time as time_sec, bpm_value as fhr, uterus_value as uc
+FROM ctg_data
+ORDER BY id DESC
+LIMIT ?
+"""
+CREATE_ANALYSIS_RESULTS_SQL = """
+CREATE TABLE IF NOT EXISTS analysis_results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts INTEGER,
+    fwbs REAL,
+    action_priority TEXT,
+    urgency_level INTEGER,
+    baseline_fhr REAL,
+    variability REAL,
+    accelerations INTEGER,
+    decelerations INTEGER,
+    signal_quality REAL,
+    ml_probability REAL,
+    fischer_score INTEGER,
+    trend_status TEXT,
+    full_result TEXT
+)
+"""
+INSERT_ANALYSIS_RESULT_SQL = """
+INSERT INTO analysis_results (
+    ts, fwbs, action_priority, urgency_level,
+    baseline_fhr, variability, accelerations, decelerations,
+    signal_quality, ml_probability, fischer_score, trend_status,
+    full_result
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# ============================================================================
+# РАЗМЕТКА АНОМАЛИЙ ЧСС ДЛЯ ГРАФИКА
+# ============================================================================
+def _label_fhr_numpy(fhr: np.ndarray, baseline: float) -> np.ndarray:
+    # Порядок условий задает приоритет типов, np.select выбирает первое выполненное условие
+    return np.select(
+        [(fhr == 0) | (fhr < 50) | (fhr > 210),
+         fhr < BRADY_THRESHOLD,
+         fhr > SEVERE_TACHY_THRESHOLD,
+         fhr > TACHY_THRESHOLD,
+         fhr > baseline + 15,
+         fhr < baseline - 30,
+         fhr < baseline - 15],
+        np.arange(1, len(GRAPH_ZONE_TYPES), dtype=np.int8), default=0)
+
+
+if njit is not None:
+    # Один проход без временных масок; fastmath не используется, чтобы NaN вел себя как в numpy-версии
+    @njit(cache=True)
+    def _label_fhr(fhr, baseline):
+        labels = np.empty(fhr.shape[0], dtype=np.int8)
+        accel_threshold = baseline + 15
+        deep_decel_threshold = baseline - 30
+        decel_threshold = baseline - 15
+        for i in range(fhr.shape[0]):
+            value = fhr[i]
+            if value == 0 or value < 50 or value > 210:
+                labels[i] = 1
+            elif value < BRADY_THRESHOLD:
+                labels[i] = 2
+            elif value > SEVERE_TACHY_THRESHOLD:
+                labels[i] = 3
+            elif value > TACHY_THRESHOLD:
+                labels[i] = 4
+            elif value > accel_threshold:
+                labels[i] = 5
+            elif value < deep_decel_threshold:
+                labels[i] = 6
+            elif value < decel_threshold:
+                labels[i] = 7
+            else:
+                labels[i] = 0
+        return labels
+
+    # Компиляция при импорте, а не на первом запросе графика (с cache=True - только при первом запуске)
+    _label_fhr(np.zeros(4), 140.0)
+else:
+    _label_fhr = _label_fhr_numpy
+
+
+def _format_clock(value: datetime) -> str:
+    """То же, что value.strftime('%H:%M:%S'), без разбора строки формата на каждый вызов"""
+    return f"{value.hour:02d}:{value.minute:02d}:{value.second:02d}"
+
+
+def _isoformat_range(start_time: datetime, count: int, step_seconds: float) -> List[str]:
+    """Метки start_time + i * step_seconds в формате isoformat(), без datetime на каждую точку"""
+    if start_time.tzinfo is not None or getattr(start_time, 'nanosecond', 0):
+        # Смещение часового пояса и наносекунды numpy в этом формате не выводит
+        return [(start_time + timedelta(seconds=i * step_seconds)).isoformat() for i in range(count)]
+    times = np.datetime64(start_time, 'us') + np.arange(count) * np.timedelta64(round(step_seconds * 1e6), 'us')
+    # isoformat() опускает дробную часть, когда микросекунды равны нулю
+    whole_seconds = times.astype(np.int64) % 1_000_000 == 0
+    return np.where(whole_seconds, np.datetime_as_string(times, unit='s'),
+                    np.datetime_as_string(times, unit='us')).tolist()
 
 # ============================================================================
 # ЭКСТРАКТОР ПРИЗНАКОВ С ПОДДЕРЖКОЙ ИНТЕРПОЛЯЦИИ
@@ -67,63 +281,121 @@ class CTGFeatureExtractor:
     def __init__(self, sampling_rate: int = TARGET_SAMPLING_RATE):
         self.sampling_rate = sampling_rate
         self.logger = logging.getLogger(f"{__name__}.CTGFeatureExtractor")
+        # Анализ повторяется каждые ANALYSIS_INTERVAL_SECONDS на окнах одной длины: сетка интерполяции
+        # и рабочие массивы очистки создаются один раз и переиспользуются между тактами
+        self._interp_grid = None
+        self._scratch_size = 0
+        self._loss_mask_buf = self._valid_mask_buf = self._clean_buf = None
         
     def interpolate_signal(self, signal_1hz: np.ndarray) -> np.ndarray:
         if len(signal_1hz) < 2:
             return signal_1hz
-        x_original = np.arange(len(signal_1hz))
-        x_interpolated = np.linspace(0, len(signal_1hz) - 1, len(signal_1hz) * INTERPOLATION_FACTOR)
-        f = interp1d(x_original, signal_1hz, kind='linear', fill_value='extrapolate')
-        return f(x_interpolated)
+        x_original, x_interpolated = self._get_interp_grid(len(signal_1hz))
+        # Новые точки лежат внутри [0, n-1], поэтому экстраполяция interp1d не нужна
+        return np.interp(x_interpolated, x_original, signal_1hz)
+    
+    def _get_interp_grid(self, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        if self._interp_grid is None or len(self._interp_grid[0]) != n:
+            self._interp_grid = (np.arange(n), np.linspace(0, n - 1, n * INTERPOLATION_FACTOR))
+        return self._interp_grid
+    
+    def _get_scratch(self, n: int, dtype) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Рабочие массивы длины n: маска потери сигнала, маска валидных точек и очищенный сигнал"""
+        if self._clean_buf is None or n > self._scratch_size or self._clean_buf.dtype != dtype:
+            self._scratch_size = max(n, self._scratch_size, LONG_WINDOW_SAMPLES)
+            self._loss_mask_buf = np.empty(self._scratch_size, dtype=bool)
+            self._valid_mask_buf = np.empty(self._scratch_size, dtype=bool)
+            self._clean_buf = np.empty(self._scratch_size, dtype=dtype)
+        return self._loss_mask_buf[:n], self._valid_mask_buf[:n], self._clean_buf[:n]
     
     def extract_features(self, fhr: np.ndarray, uc: np.ndarray, window_type: str = 'long') -> Dict[str, float]:
+        fhr = np.asarray(fhr, dtype=FEATURE_DTYPE)
+        uc = np.asarray(uc, dtype=FEATURE_DTYPE)
+        return self._extract_features(fhr, uc, window_type, self._signal_loss_mask(fhr), uc > 0)
+    
+    def extract_features_pair(self, fhr: np.ndarray, uc: np.ndarray,
+                              window_type: str = 'long') -> Tuple[Dict[str, float], Dict[str, float]]:
+        """
+        Признаки окна и его краткосрочного хвоста (последние SHORT_WINDOW_SAMPLES точек).
+        Маски потери сигнала и положительных значений UC считаются один раз, для хвоста берутся их срезы
+        """
+        fhr = np.asarray(fhr, dtype=FEATURE_DTYPE)
+        uc = np.asarray(uc, dtype=FEATURE_DTYPE)
+        signal_loss_mask = self._signal_loss_mask(fhr)
+        uc_positive = uc > 0
+        features = self._extract_features(fhr, uc, window_type, signal_loss_mask, uc_positive)
+        if len(fhr) < SHORT_WINDOW_SAMPLES:
+            return features, features
+        # Очистка и baseline хвоста считаются по самому хвосту (медиана замены своя), как при отдельном вызове
+        features_short = self._extract_features(fhr[-SHORT_WINDOW_SAMPLES:], uc[-SHORT_WINDOW_SAMPLES:], 'short',
+                                                signal_loss_mask[-SHORT_WINDOW_SAMPLES:], uc_positive[-SHORT_WINDOW_SAMPLES:])
+        return features, features_short
+    
+    def _signal_loss_mask(self, fhr: np.ndarray) -> np.ndarray:
+        # Маска пишется в рабочий буфер; нулевые значения уже входят в fhr < 50
+        loss_mask, above_mask, _ = self._get_scratch(len(fhr), fhr.dtype)
+        np.less(fhr, 50, out=loss_mask)
+        np.greater(fhr, 210, out=above_mask)
+        return np.logical_or(loss_mask, above_mask, out=loss_mask)
+    
+    def _extract_features(self, fhr: np.ndarray, uc: np.ndarray, window_type: str,
+                          signal_loss_mask: np.ndarray, uc_positive: np.ndarray) -> Dict[str, float]:
         features = {}
         min_pattern_duration = SHORT_PATTERN_MIN_DURATION if window_type == 'short' else 15 * self.sampling_rate
         prolonged_duration = SHORT_PROLONGED_DURATION if window_type == 'short' else 90 * self.sampling_rate
         
-        signal_loss_mask = (fhr == 0) | (fhr < 50) | (fhr > 210)
-        signal_loss_ratio = np.sum(signal_loss_mask) / len(fhr) if len(fhr) > 0 else 0
+        signal_loss_ratio = np.count_nonzero(signal_loss_mask) / len(fhr) if len(fhr) > 0 else 0
         features['signal_loss_ratio'] = signal_loss_ratio
         
         fhr_clean = self._clean_signal(fhr, signal_loss_mask)
         baseline = self._calculate_baseline(fhr_clean)
+        # Порядковые статистики за один вызов percentile (0-й и 100-й равны min и max),
+        # вариабельность считается один раз для ltv и variability
+        fhr_min, fhr_q25, fhr_q75, fhr_max = np.percentile(fhr_clean, [0, 25, 75, 100])
+        fhr_mean = np.mean(fhr_clean)
+        fhr_skewness, fhr_kurtosis = self._skew_kurtosis(fhr_clean, fhr_mean) if len(fhr_clean) > 1 else (0, 0)
+        stv = self._calculate_stv(fhr_clean)
+        ltv = stv * 2 if window_type == 'short' else self._calculate_ltv(fhr_clean)
         
         features.update({
             'baseline_bpm': baseline,
             'fhr_median': baseline,
-            'fhr_mean': np.mean(fhr_clean),
+            'fhr_mean': fhr_mean,
             'fhr_std': np.std(fhr_clean),
-            'fhr_min': np.min(fhr_clean),
-            'fhr_max': np.max(fhr_clean),
-            'fhr_q25': np.percentile(fhr_clean, 25),
-            'fhr_q75': np.percentile(fhr_clean, 75),
-            'fhr_iqr': np.percentile(fhr_clean, 75) - np.percentile(fhr_clean, 25),
-            'stv': self._calculate_stv(fhr_clean),
-            'ltv': self._calculate_stv(fhr_clean) * 2 if window_type == 'short' else self._calculate_ltv(fhr_clean),
-            'variability': self._calculate_stv(fhr_clean) * 2 if window_type == 'short' else self._calculate_ltv(fhr_clean)
+            'fhr_min': fhr_min,
+            'fhr_max': fhr_max,
+            'fhr_q25': fhr_q25,
+            'fhr_q75': fhr_q75,
+            'fhr_iqr': fhr_q75 - fhr_q25,
+            'stv': stv,
+            'ltv': ltv,
+            'variability': ltv
         })
         
         patterns = self._detect_patterns(fhr_clean, baseline, min_pattern_duration, prolonged_duration)
         features.update(patterns)
         
-        uc_clean = uc[uc > 0] if len(uc) > 0 and np.any(uc > 0) else np.array([0])
+        uc_clean = uc[uc_positive] if uc_positive.any() else np.array([0])
         features.update({
             'uc_mean': np.mean(uc_clean),
             'uc_max': np.max(uc_clean),
             'uc_std': np.std(uc_clean),
             'fhr_entropy': self._calculate_entropy(fhr_clean),
-            'fhr_skewness': skew(fhr_clean) if len(fhr_clean) > 1 else 0,
-            'fhr_kurtosis': kurtosis(fhr_clean) if len(fhr_clean) > 1 else 0,
+            'fhr_skewness': fhr_skewness,
+            'fhr_kurtosis': fhr_kurtosis,
             'accelerations': patterns.get('accelerations_count', 0),
             'decelerations': patterns.get('decelerations_count', 0)
         })
         
-        return features
+        # Скаляры float32 не сериализуются в JSON и не должны попадать в результат анализа
+        return {name: float(value) if isinstance(value, np.floating) else value for name, value in features.items()}
     
     def _clean_signal(self, fhr: np.ndarray, signal_loss_mask: np.ndarray) -> np.ndarray:
-        clean_fhr = np.copy(fhr)
-        valid_mask = ~signal_loss_mask
-        if np.sum(valid_mask) > 0:
+        # Маска потери сигнала лежит в своем буфере (или его срезе), валидные точки и копия сигнала - в других
+        _, valid_mask, clean_fhr = self._get_scratch(len(fhr), fhr.dtype)
+        np.copyto(clean_fhr, fhr)
+        np.logical_not(signal_loss_mask, out=valid_mask)
+        if np.count_nonzero(valid_mask) > 0:
             median_val = np.median(fhr[valid_mask])
             clean_fhr[signal_loss_mask] = median_val
         return clean_fhr
@@ -152,44 +424,61 @@ class CTGFeatureExtractor:
         deep_threshold = baseline - 30
         
         above_accel = fhr > accel_threshold
-        accel_segments = self._find_segments(above_accel, min_duration)
-        patterns['accelerations_count'] = len(accel_segments)
+        accel_starts, _ = self._find_segments(above_accel, min_duration)
+        patterns['accelerations_count'] = len(accel_starts)
         
         below_decel = fhr < decel_threshold
-        decel_segments = self._find_segments(below_decel, min_duration)
-        patterns['decelerations_count'] = len(decel_segments)
+        decel_starts, decel_ends = self._find_segments(below_decel, min_duration)
+        patterns['decelerations_count'] = len(decel_starts)
         
-        deep_count = prolonged_count = 0
-        for start, end in decel_segments:
-            if np.min(fhr[start:end]) < deep_threshold:
-                deep_count += 1
-            if end - start >= prolonged_duration:
-                prolonged_count += 1
-        patterns['deep_decelerations_count'] = deep_count
-        patterns['prolonged_decelerations'] = prolonged_count
+        # Глубокая децелерация - в сегменте есть точка ниже deep_threshold; число таких точек
+        # в каждом сегменте берется из накопленной суммы маски, без цикла по сегментам
+        deep_cumsum = np.concatenate(([0], np.cumsum(fhr < deep_threshold)))
+        deep_per_segment = deep_cumsum[decel_ends] - deep_cumsum[decel_starts]
+        patterns['deep_decelerations_count'] = int(np.count_nonzero(deep_per_segment))
+        patterns['prolonged_decelerations'] = int(np.count_nonzero(decel_ends - decel_starts >= prolonged_duration))
         
         return patterns
     
-    def _find_segments(self, mask: np.ndarray, min_length: int) -> List[Tuple[int, int]]:
-        segments = []
-        in_segment = False
-        start = 0
-        for i in range(len(mask)):
-            if mask[i] and not in_segment:
-                in_segment = True
-                start = i
-            elif not mask[i] and in_segment:
-                in_segment = False
-                if i - start >= min_length:
-                    segments.append((start, i))
-        if in_segment and len(mask) - start >= min_length:
-            segments.append((start, len(mask)))
-        return segments
+    def _find_segments(self, mask: np.ndarray, min_length: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Начала и концы (не включая) участков маски длиной не меньше min_length"""
+        # Границы участков - места смены значения маски; нули по краям закрывают участки у краев окна
+        padded = np.concatenate(([0], mask.astype(np.int8), [0]))
+        edges = np.flatnonzero(np.diff(padded))
+        starts, ends = edges[::2], edges[1::2]
+        keep = ends - starts >= min_length
+        return starts[keep], ends[keep]
+    
+    def _skew_kurtosis(self, x: np.ndarray, mean: float):
+        """Асимметрия и эксцесс (по Фишеру) со смещением, как scipy.stats.skew/kurtosis по умолчанию"""
+        d = x - mean
+        d2 = d * d
+        m2 = np.mean(d2)
+        # Как и в scipy, для практически постоянного сигнала моменты не определены
+        if m2 <= (np.finfo(d.dtype).eps * mean) ** 2:
+            return np.nan, np.nan
+        return np.mean(d2 * d) / m2 ** 1.5, np.mean(d2 * d2) / (m2 * m2) - 3.0
     
     def _calculate_entropy(self, signal: np.ndarray, bins: int = 10) -> float:
         if len(signal) == 0:
             return 0
-        hist, _ = np.histogram(signal, bins=bins)
+        # Равные интервалы по размаху данных, как у np.histogram: номер интервала считается
+        # одним линейным проходом, максимум попадает в последний интервал
+        low, high = float(np.min(signal)), float(np.max(signal))
+        if high > low:
+            # Границы в той же точности, что у np.histogram: float32 для float32, float64 для целых
+            edges_dtype = np.result_type(low, high, signal)
+            if np.issubdtype(edges_dtype, np.integer):
+                edges_dtype = np.result_type(edges_dtype, float)
+            edges = np.linspace(low, high, bins + 1, dtype=edges_dtype)
+            idx = ((signal - low) / (high - low) * bins).astype(np.intp)
+            np.minimum(idx, bins - 1, out=idx)
+            # Поправка на округление у границ интервалов, та же, что в np.histogram
+            idx -= signal < edges[idx]
+            idx += (signal >= edges[idx + 1]) & (idx != bins - 1)
+        else:
+            idx = np.zeros(len(signal), dtype=np.intp)
+        hist = np.bincount(idx, minlength=bins)
         hist = hist[hist > 0]
         if len(hist) == 0:
             return 0
@@ -239,8 +528,8 @@ class TrendAnalyzer:
     """
     Анализ трендов для оценки динамики состояния плода
     """
-    def analyze(self, history_df: pd.DataFrame) -> Dict[str, Any]:
-        if len(history_df) < LONG_WINDOW_SAMPLES:
+    def analyze(self, fhr: np.ndarray) -> Dict[str, Any]:
+        if len(fhr) < LONG_WINDOW_SAMPLES:
             return {
                 'status': 'insufficient_data',
                 'description': 'Недостаточно данных для анализа тренда',
@@ -250,7 +539,6 @@ class TrendAnalyzer:
                 'recent_change': 0
             }
         
-        fhr = history_df['fhr'].values
         third = len(fhr) // 3
         first_third_median = np.median(fhr[:third])
         middle_third_median = np.median(fhr[third:2*third])
@@ -270,7 +558,7 @@ class TrendAnalyzer:
         else:
             status, description, trend_score = 'stable', 'Незначительные изменения', 0.1
         
-        confidence = min(1.0, len(history_df) / LONG_WINDOW_SAMPLES)
+        confidence = min(1.0, len(fhr) / LONG_WINDOW_SAMPLES)
         
         return {
             'status': status,
@@ -295,14 +583,24 @@ class PredictionService:
         self.trend_analyzer = TrendAnalyzer()
         self.db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), db_path) if db_path else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'guardian_angel_data.db')
         self.model_path = model_path
+        self._db: Optional[aiosqlite.Connection] = None
+        self._db_lock = asyncio.Lock()
         self.model = None
         self.scaler = None
         self.model_available = False
         self.model_threshold = 0.5
         self.feature_names = None
+        self._feature_names_tuple: Optional[Tuple[str, ...]] = None
+        self._onnx_session = None
+        self._onnx_output_name: Optional[str] = None
+        self._prediction_queue: Optional[asyncio.Queue] = None
+        self._prediction_batcher_task: Optional[asyncio.Task] = None
+        self._save_queue: Optional[asyncio.Queue] = None
+        self._save_task: Optional[asyncio.Task] = None
         self._load_ml_model(model_path)
         self.last_analysis_result = {}
-        self.analysis_history = []
+        # Последние ANALYSIS_HISTORY_SIZE анализов; старые записи deque вытесняет сам, без сдвига списка
+        self.analysis_history = deque(maxlen=ANALYSIS_HISTORY_SIZE)
         self.version = __version__
         self.initialized_at = datetime.now()
         self.logger.info(f"PredictionService v{self.version} initialized")
@@ -318,93 +616,189 @@ class PredictionService:
                 self.model_threshold = model_data.get('optimal_threshold', 0.5)
                 if hasattr(self.scaler, 'feature_names_in_'):
                     self.feature_names = self.scaler.feature_names_in_
+                    # Порядок признаков модели после загрузки не меняется: кортеж строк обходится
+                    # быстрее, чем массив numpy объектов feature_names_in_
+                    self._feature_names_tuple = tuple(str(name) for name in self.feature_names)
                 self.model_available = True
                 self.logger.info(f"ML model loaded from {model_path}")
+                self._load_onnx_session(model_path)
             else:
                 self.logger.warning(f"ML model file not found: {model_path}")
         except Exception as e:
             self.logger.error(f"Error loading ML model: {e}")
             self.model_available = False
     
-    async def get_data_from_db(self, limit: int = 600) -> pd.DataFrame:
-        async with aiosqlite.connect(self.db_path) as db:
-            query = """
-            SELECT ts, bpm_time as time_sec, bpm_value as fhr, uterus_value as uc
-            FROM ctg_data
-            ORDER BY id DESC
-            LIMIT ?
-            """
-            async with db.execute(query, (limit,)) as cursor:
-                rows = await cursor.fetchall()
-                if not rows:
-                    return pd.DataFrame()
-                df = pd.DataFrame(rows, columns=['ts', 'time_sec', 'fhr', 'uc'])
-                return df.iloc[::-1].reset_index(drop=True)
+    def _load_onnx_session(self, model_path: str):
+        # Скалер и модель, собранные в один граф ONNX, считаются без Python-вызовов sklearn на каждый анализ.
+        # Граф хранится рядом с pickle и пересобирается, если pickle новее; при любой ошибке остается sklearn
+        if ort is None:
+            return
+        onnx_path = os.path.splitext(model_path)[0] + '.onnx'
+        try:
+            if not os.path.exists(onnx_path) or os.path.getmtime(onnx_path) < os.path.getmtime(model_path):
+                if convert_sklearn is None:
+                    return
+                _register_onnx_converters()
+                if not self._onnx_convertible():
+                    # Для такой модели конвертера нет: экспорт не пробуем и не предупреждаем при каждом запуске
+                    self.logger.debug(f"No ONNX converter for {type(self.model).__name__}, using it directly")
+                    return
+                self._export_to_onnx(onnx_path)
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = 1
+            session = ort.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+            output_names = [output.name for output in session.get_outputs()]
+            if ONNX_PROBABILITIES_OUTPUT not in output_names:
+                raise ValueError(f"no '{ONNX_PROBABILITIES_OUTPUT}' output in {output_names}")
+            self._onnx_session = session
+            self._onnx_output_name = ONNX_PROBABILITIES_OUTPUT
+            self.logger.info(f"ONNX model loaded from {onnx_path}")
+        except Exception as e:
+            self.logger.warning(f"ONNX model unavailable, using sklearn: {e}")
+            self._onnx_session = None
+    
+    def _onnx_convertible(self) -> bool:
+        if type(self.model).__module__.startswith('sklearn.'):
+            return True
+        return _onnx_converters_registered and isinstance(self.model, XGBClassifier)
+    
+    def _export_to_onnx(self, onnx_path: str):
+        from sklearn.pipeline import Pipeline
+        steps = [('model', self.model)] if self.scaler is None else [('scaler', self.scaler), ('model', self.model)]
+        n_features = len(self.feature_names) if self.feature_names is not None else self.scaler.n_features_in_
+        # zipmap=False - вероятности классов тензором [N, 2], а не списком словарей
+        onnx_model = convert_sklearn(Pipeline(steps), initial_types=[('X', FloatTensorType([None, n_features]))],
+                                     options={id(self.model): {'zipmap': False}})
+        with open(onnx_path, 'wb') as f:
+            f.write(onnx_model.SerializeToString())
+        self.logger.info(f"ML model exported to {onnx_path}")
+    
+    async def _get_db(self) -> aiosqlite.Connection:
+        # Одно соединение на все время работы сервиса: без открытия файла, настройки pragma
+        # и CREATE TABLE на каждый анализ; lock не дает двум анализам открыть его одновременно
+        async with self._db_lock:
+            if self._db is None:
+                db = await aiosqlite.connect(self.db_path)
+                await db.execute("PRAGMA journal_mode=WAL")
+                await db.execute("PRAGMA synchronous=NORMAL")
+                await db.execute("PRAGMA temp_store=MEMORY")
+                await db.execute(CREATE_ANALYSIS_RESULTS_SQL)
+                await db.commit()
+                self._db = db
+        return self._db
+    
+    async def close(self):
+        task = self._save_task
+        if task is not None:
+            # None в очереди - сигнал записать накопленные строки и завершиться
+            if not task.done() and task.get_loop() is asyncio.get_running_loop():
+                self._save_queue.put_nowait(None)
+                await asyncio.gather(task, return_exceptions=True)
+            self._save_task = None
+        if self._prediction_batcher_task is not None:
+            self._prediction_batcher_task.cancel()
+            await asyncio.gather(self._prediction_batcher_task, return_exceptions=True)
+            self._prediction_batcher_task = None
+            # Обработчик, отмененный до первого шага, очередь не разбирал
+            self._fail_pending_predictions(self._prediction_queue, [])
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
     
-    async def save_analysis_result(self, result: Dict[str, Any]):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS analysis_results (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ts INTEGER,
-                    fwbs REAL,
-                    action_priority TEXT,
-                    urgency_level INTEGER,
-                    baseline_fhr REAL,
-                    variability REAL,
-                    accelerations INTEGER,
-                    decelerations INTEGER,
-                    signal_quality REAL,
-                    ml_probability REAL,
-                    fischer_score INTEGER,
-                    trend_status TEXT,
-                    full_result TEXT
-                )
-            ''')
-            await db.execute('''
-                INSERT INTO analysis_results (
-                    ts, fwbs, action_priority, urgency_level,
-                    baseline_fhr, variability, accelerations, decelerations,
-                    signal_quality, ml_probability, fischer_score, trend_status,
-                    full_result
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                int(datetime.now().timestamp()),
-                result.get('fetal_wellbeing_index', 0),
-                result.get('action_priority', 'UNKNOWN'),
-                result.get('urgency_level', 0),
-                result.get('baseline_fhr', 0),
-                result.get('variability', 0),
-                result.get('accelerations', 0),
-                result.get('decelerations', 0),
-                result.get('signal_quality', 0),
-                result.get('ml_probability', 0),
-                result.get('fischer_score', 0),
-                result.get('trend_status', 'unknown'),
-                json.dumps(result)
-            ))
-            await db.commit()
-            self.logger.info("Analysis result saved to database")
+    async def get_data_from_db(self, limit: int = 600) -> np.ndarray:
+        db = await self._get_db()
+        async with db.execute(SELECT_RECENT_CTG_SQL, (limit,)) as cursor:
+            rows = await cursor.fetchall()
+        if not rows:
+            return np.empty(0, dtype=CTG_RECORD_DTYPE)
+        # NULL превращается в NaN, как при построении DataFrame; строки float64 без копирования
+        # читаются как записи CTG_RECORD_DTYPE, разворот к хронологическому порядку - тоже view
+        values = np.array(rows, dtype=np.float64)
+        return values.view(CTG_RECORD_DTYPE).reshape(-1)[::-1]
     
-    def _predict_with_ml(self, features: Dict[str, float]) -> Dict[str, Any]:
+    async def save_analysis_result(self, result: Dict[str, Any], timestamp: Optional[datetime] = None):
+        row = (
+            int((timestamp or datetime.now()).timestamp()),
+            result.get('fetal_wellbeing_index', 0),
+            result.get('action_priority', 'UNKNOWN'),
+            result.get('urgency_level', 0),
+            result.get('baseline_fhr', 0),
+            result.get('variability', 0),
+            result.get('accelerations', 0),
+            result.get('decelerations', 0),
+            result.get('signal_quality', 0),
+            result.get('ml_probability', 0),
+            result.get('fischer_score', 0),
+            result.get('trend_status', 'unknown'),
+            dumps_result(result)
+        )
+        # Запись идет в фоне: анализ не ждет commit, строки нескольких анализов уходят одним executemany
+        loop = asyncio.get_running_loop()
+        task = self._save_task
+        if task is None or task.done() or task.get_loop() is not loop:
+            self._save_queue = asyncio.Queue()
+            self._save_task = asyncio.create_task(self._analysis_saver(self._save_queue))
+        self._save_queue.put_nowait(row)
+    
+    async def _analysis_saver(self, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            row = await queue.get()
+            if row is None:
+                return
+            batch = [row]
+            deadline = loop.time() + ANALYSIS_SAVE_BATCH_WINDOW_SECONDS
+            while len(batch) < ANALYSIS_SAVE_BATCH_MAX_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+            try:
+                db = await self._get_db()
+                await db.executemany(INSERT_ANALYSIS_RESULT_SQL, batch)
+                await db.commit()
+            except Exception as e:
+                self.logger.error(f"Error saving analysis results: {e}")
+                continue
+            self.logger.info(f"Analysis results saved to database: {len(batch)}")
+    
+    async def _predict_with_ml(self, features: Dict[str, float]) -> Dict[str, Any]:
         if not self.model_available:
             self.logger.warning("ML model unavailable, falling back to expert rules")
             return self._predict_with_rules(features)
         try:
-            self.logger.info(f"Expected features: {self.feature_names}")
-            self.logger.info(f"Provided features: {list(features.keys())}")
+            # Отладочный вывод каждого предсказания: строки с признаками собираются, только если уровень DEBUG включен
+            debug = self.logger.isEnabledFor(logging.DEBUG)
+            if debug:
+                self.logger.debug("Expected features: %s", self.feature_names)
+                self.logger.debug("Provided features: %s", list(features.keys()))
             if self.feature_names is not None:
-                feature_vector = np.array([features.get(name, 0) for name in self.feature_names])
+                # Вектор собирается сразу в массив, без промежуточного списка; для каждого анализа
+                # свой массив, так как векторы ждут в очереди пакетного предсказания
+                names = self._feature_names_tuple
+                feature_vector = np.fromiter(map(features.get, names, repeat(0, len(names))),
+                                             dtype=np.float64, count=len(names))
                 if len(feature_vector) != len(self.feature_names):
                     self.logger.error(f"Feature vector length mismatch: expected {len(self.feature_names)}, got {len(feature_vector)}")
                     return self._predict_with_rules(features)
             else:
                 feature_vector = np.array([features[key] for key in sorted(features.keys())])
             
-            self.logger.info(f"Feature vector: {feature_vector}")
-            self.logger.info(f"Feature vector shape: {feature_vector.shape}")
-            feature_scaled = self.scaler.transform(feature_vector.reshape(1, -1))
-            probability = self.model.predict_proba(feature_scaled)[0, 1]
+            if debug:
+                self.logger.debug("Feature vector: %s", feature_vector)
+                self.logger.debug("Feature vector shape: %s", feature_vector.shape)
+            # Проверка своего вектора до очереди: иначе одна строка с NaN уронила бы весь пакет
+            if not np.isfinite(feature_vector).all():
+                raise ValueError("Feature vector contains NaN or infinity")
+            probability = await self._submit_prediction(feature_vector)
             risk_level = "CRITICAL" if probability > 0.75 else "HIGH" if probability > 0.5 else "MODERATE" if probability > 0.25 else "LOW"
             return {
                 'hypoxia_probability': float(probability),
@@ -416,9 +810,78 @@ class PredictionService:
             self.logger.error(f"ML prediction failed: {e}")
             return self._predict_with_rules(features)
     
+    def _predict_probabilities(self, feature_matrix: np.ndarray) -> np.ndarray:
+        """Вероятности класса гипоксии для строк feature_matrix"""
+        if self._onnx_session is not None:
+            # Из выходов графа (метка класса и вероятности классов) берется только тензор вероятностей
+            input_name = self._onnx_session.get_inputs()[0].name
+            probabilities = self._onnx_session.run(
+                [self._onnx_output_name],
+                {input_name: feature_matrix.astype(np.float32)})[0]
+        else:
+            from sklearn import config_context
+            # Строки уже проверены на NaN и бесконечность в _predict_with_ml: check_array скалера
+            # и модели не повторяет эту проверку на каждом вызове
+            with config_context(assume_finite=True):
+                probabilities = self.model.predict_proba(self.scaler.transform(feature_matrix))
+        return probabilities[:, 1]
+    
+    async def _submit_prediction(self, feature_vector: np.ndarray) -> float:
+        # Очередь и пакетный обработчик создаются в текущем цикле событий при первом запросе
+        loop = asyncio.get_running_loop()
+        task = self._prediction_batcher_task
+        if task is None or task.done() or task.get_loop() is not loop:
+            self._prediction_queue = asyncio.Queue()
+            self._prediction_batcher_task = asyncio.create_task(self._prediction_batcher(self._prediction_queue))
+        future = loop.create_future()
+        self._prediction_queue.put_nowait((feature_vector, future))
+        return await future
+    
+    async def _prediction_batcher(self, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        batch = []
+        try:
+            while True:
+                batch = [await queue.get()]
+                # Ждем другие запросы не дольше окна: у модели фиксированная стоимость вызова, строки почти бесплатны
+                deadline = loop.time() + PREDICTION_BATCH_WINDOW_SECONDS
+                while len(batch) < PREDICTION_BATCH_MAX_SIZE:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                try:
+                    probabilities = self._predict_probabilities(np.vstack([vector for vector, _ in batch]))
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (_, future), probability in zip(batch, probabilities):
+                    if not future.done():
+                        future.set_result(probability)
+        except asyncio.CancelledError:
+            self._fail_pending_predictions(queue, batch)
+            raise
+    
+    @staticmethod
+    def _fail_pending_predictions(queue: asyncio.Queue, batch: List[tuple]):
+        # Запросы уже собранного пакета и оставшиеся в очереди не должны ждать вечно:
+        # ошибка уводит _predict_with_ml на запасной путь, как при сбое модели
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+        error = RuntimeError('Prediction batcher stopped')
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+    
     def _predict_with_rules(self, features: Dict[str, float]) -> Dict[str, Any]:
         risk_score = 0.0
         risk_factors = []
+        risk_flags = RiskFlag.NONE
         baseline = features.get('baseline_bpm', 140)
         variability = features.get('variability', 10)
         accelerations = features.get('accelerations_count', 0)
@@ -429,12 +892,14 @@ class PredictionService:
         if baseline < 100:
             risk_score += 0.8
             risk_factors.append(f"Критическая брадикардия: {baseline:.0f} bpm")
+            risk_flags |= RiskFlag.CRITICAL_BRADYCARDIA
         elif baseline < 110:
             risk_score += 0.5
             risk_factors.append(f"Брадикардия: {baseline:.0f} bpm")
         if baseline > 170:
             risk_score += 0.7
             risk_factors.append(f"Выраженная тахикардия: {baseline:.0f} bpm")
+            risk_flags |= RiskFlag.MARKED_TACHYCARDIA
         elif baseline > 160:
             risk_score += 0.4
             risk_factors.append(f"Тахикардия: {baseline:.0f} bpm")
@@ -444,6 +909,7 @@ class PredictionService:
         elif variability < 3:
             risk_score += 0.5
             risk_factors.append(f"Сниженная вариабельность: {variability:.1f} bpm")
+            risk_flags |= RiskFlag.REDUCED_VARIABILITY
         elif variability < 5:
             risk_score += 0.3
             risk_factors.append(f"Пограничная вариабельность: {variability:.1f} bpm")
@@ -474,13 +940,13 @@ class PredictionService:
             'risk_level': risk_level,
             'confidence': 0.85,
             'method': 'expert_rules',
-            'risk_factors': risk_factors
+            'risk_factors': risk_factors,
+            'risk_flags': risk_flags
         }
     
     def _calculate_fwbs(self, fischer_result: Dict, ml_result: Dict, trend_result: Dict, signal_quality: float, clinical_risks: int) -> float:
         fwbs = 100.0
-        rule_weight = 0.7 if ml_result['method'] == 'expert_rules' else 0.6
-        fischer_weight = 0.3 if ml_result['method'] == 'expert_rules' else 0.2
+        rule_weight, fischer_weight = FWBS_RULES_WEIGHTS if ml_result['method'] == 'expert_rules' else FWBS_ML_WEIGHTS
         
         fischer_penalty = (10 - fischer_result['total_score']) * 2
         fwbs -= fischer_penalty * fischer_weight
@@ -489,14 +955,14 @@ class PredictionService:
         if trend_result['status'] != 'insufficient_data':
             trend_penalty = trend_result.get('trend_score', 0) * 40
             fwbs -= trend_penalty * 0.2
-        if 'risk_factors' in ml_result:
-            for factor in ml_result['risk_factors']:
-                if 'Критическая' in factor:
-                    fwbs -= 20
-                elif 'Выраженная' in factor:
-                    fwbs -= 15
-                elif 'Сниженная вариабельность' in factor:
-                    fwbs -= 10
+        # Флаги выставляются в _predict_with_rules вместе с текстом факторов, строки здесь не разбираются
+        risk_flags = ml_result.get('risk_flags', RiskFlag.NONE)
+        if risk_flags & RiskFlag.CRITICAL_BRADYCARDIA:
+            fwbs -= 20
+        if risk_flags & RiskFlag.MARKED_TACHYCARDIA:
+            fwbs -= 15
+        if risk_flags & RiskFlag.REDUCED_VARIABILITY:
+            fwbs -= 10
         if signal_quality < 0.5:
             fwbs -= 10
         elif signal_quality < 0.7:
@@ -523,76 +989,71 @@ class PredictionService:
         """
         patterns = []
         current_time = start_time if start_time else datetime.now()
+        # Время обнаружения одно для всех паттернов окна: строки форматируются один раз
+        detected_at = current_time.isoformat()
+        detected_at_readable = _format_clock(current_time)
+        prolonged_decelerations = features.get('prolonged_decelerations', 0)
+        deep_decelerations = features.get('deep_decelerations_count', 0)
+        variability = features.get('variability', 10)
+        accelerations = features.get('accelerations_count', 0)
+        baseline = features.get('baseline_bpm', 140)
         
-        # Словарь переводов паттернов
-        PATTERN_TRANSLATIONS = {
-            'prolonged_deceleration': 'Пролонгированная децелерация',
-            'repeated_deep_decelerations': 'Повторные глубокие децелерации',
-            'reduced_variability': 'Сниженная вариабельность',
-            'absent_accelerations': 'Отсутствие акселераций',
-            'bradycardia': 'Брадикардия',
-            'tachycardia': 'Тахикардия',
-            'poor_signal_quality': 'Низкое качество сигнала'
-        }
-        
-        if features.get('prolonged_decelerations', 0) > 0:
+        if prolonged_decelerations > 0:
             pattern_type = 'prolonged_deceleration'
             patterns.append({
                 'type': pattern_type,
-                'name': PATTERN_TRANSLATIONS.get(pattern_type, pattern_type),
+                'name': _PATTERN_TRANSLATIONS.get(pattern_type, pattern_type),
                 'severity': 'high',
-                'count': features['prolonged_decelerations'],
-                'detected_at': current_time.isoformat(),
-                'detected_at_readable': current_time.strftime('%H:%M:%S'),
+                'count': prolonged_decelerations,
+                'detected_at': detected_at,
+                'detected_at_readable': detected_at_readable,
                 'clinical_significance': 'Требует немедленного внимания'
             })
         
-        if features.get('deep_decelerations_count', 0) > 1:
+        if deep_decelerations > 1:
             pattern_type = 'repeated_deep_decelerations'
             patterns.append({
                 'type': pattern_type,
-                'name': PATTERN_TRANSLATIONS.get(pattern_type, pattern_type),
+                'name': _PATTERN_TRANSLATIONS.get(pattern_type, pattern_type),
                 'severity': 'high',
-                'count': features['deep_decelerations_count'],
-                'detected_at': current_time.isoformat(),
-                'detected_at_readable': current_time.strftime('%H:%M:%S'),
+                'count': deep_decelerations,
+                'detected_at': detected_at,
+                'detected_at_readable': detected_at_readable,
                 'clinical_significance': 'Возможная компрессия пуповины'
             })
         
-        variability = features.get('variability', 10)
         if variability < 4:
             pattern_type = 'reduced_variability'
             patterns.append({
                 'type': pattern_type,
-                'name': PATTERN_TRANSLATIONS.get(pattern_type, pattern_type),
+                'name': _PATTERN_TRANSLATIONS.get(pattern_type, pattern_type),
                 'severity': 'high' if variability < 2 else 'moderate',
                 'value': variability,
-                'detected_at': current_time.isoformat(),
-                'detected_at_readable': current_time.strftime('%H:%M:%S'),
+                'detected_at': detected_at,
+                'detected_at_readable': detected_at_readable,
                 'clinical_significance': 'Возможное угнетение ЦНС плода'
             })
         
-        if features.get('accelerations_count', 0) == 0:
+        if accelerations == 0:
             pattern_type = 'absent_accelerations'
             patterns.append({
                 'type': pattern_type,
-                'name': PATTERN_TRANSLATIONS.get(pattern_type, pattern_type),
+                'name': _PATTERN_TRANSLATIONS.get(pattern_type, pattern_type),
                 'severity': 'moderate',
-                'detected_at': current_time.isoformat(),
-                'detected_at_readable': current_time.strftime('%H:%M:%S'),
+                'detected_at': detected_at,
+                'detected_at_readable': detected_at_readable,
                 'clinical_significance': 'Снижение реактивности плода'
             })
         
-        baseline = features.get('baseline_bpm', 140)
         if baseline < 110 and baseline > 0:
             pattern_type = 'bradycardia'
             patterns.append({
                 'type': pattern_type,
-                'name': PATTERN_TRANSLATIONS.get(pattern_type, pattern_type),
+                'name': _PATTERN_TRANSLATIONS.get(pattern_type, pattern_type),
                 'severity': 'high' if baseline < 100 else 'moderate',
                 'value': baseline,
-                'detected_at': current_time.isoformat(),
-                'detected_at_readable': current_time.strftime('%H:%M:%S'),
+                'detected_at': detected_at,
+                'detected_at_readable': detected_at_readable,
                 'clinical_significance': 'Возможная гипоксия'
             })
         
@@ -600,11 +1061,11 @@ class PredictionService:
             pattern_type = 'tachycardia'
             patterns.append({
                 'type': pattern_type,
-                'name': PATTERN_TRANSLATIONS.get(pattern_type, pattern_type),
+                'name': _PATTERN_TRANSLATIONS.get(pattern_type, pattern_type),
                 'severity': 'high' if baseline > 170 else 'moderate',
                 'value': baseline,
-                'detected_at': current_time.isoformat(),
-                'detected_at_readable': current_time.strftime('%H:%M:%S'),
+                'detected_at': detected_at,
+                'detected_at_readable': detected_at_readable,
                 'clinical_significance': 'Возможная инфекция или гипоксия'
             })
         
@@ -612,11 +1073,11 @@ class PredictionService:
             pattern_type = 'poor_signal_quality'
             patterns.append({
                 'type': pattern_type,
-                'name': PATTERN_TRANSLATIONS.get(pattern_type, pattern_type),
+                'name': _PATTERN_TRANSLATIONS.get(pattern_type, pattern_type),
                 'severity': 'low',
                 'value': signal_quality,
-                'detected_at': current_time.isoformat(),
-                'detected_at_readable': current_time.strftime('%H:%M:%S'),
+                'detected_at': detected_at,
+                'detected_at_readable': detected_at_readable,
                 'clinical_significance': 'Требуется переустановка датчиков'
             })
         
@@ -630,101 +1091,46 @@ class PredictionService:
         if start_time is None:
             start_time = datetime.now()
         
-        timestamps = [(start_time + timedelta(seconds=i * 0.25)).isoformat() 
-                     for i in range(len(fhr_4hz))]
+        timestamps = _isoformat_range(start_time, len(fhr_4hz), 0.25)
         
-        brady_threshold = 110
-        tachy_threshold = 160
-        severe_tachy_threshold = 170
-        accel_threshold = baseline + 15
-        decel_threshold = baseline - 15
-        deep_decel_threshold = baseline - 30
+        # Каждой точке присваивается код типа аномалии из GRAPH_ZONE_TYPES (0 - нет аномалии)
+        labels = _label_fhr(np.asarray(fhr_4hz, dtype=np.float64), float(baseline))
         
         anomaly_zones = []
-        current_anomaly = None
-        anomaly_start_idx = None
-        anomaly_severity = None
-        
-        for i, value in enumerate(fhr_4hz):
-            anomaly_type = None
-            severity = None
-            
-            if value == 0 or value < 50 or value > 210:
-                anomaly_type = 'signal_loss'
-                severity = 'warning'
-            elif value < brady_threshold:
-                anomaly_type = 'bradycardia'
-                severity = 'critical' if value < 100 else 'high'
-            elif value > severe_tachy_threshold:
-                anomaly_type = 'severe_tachycardia'
-                severity = 'critical'
-            elif value > tachy_threshold:
-                anomaly_type = 'tachycardia'
-                severity = 'high'
-            elif value > accel_threshold:
-                anomaly_type = 'acceleration'
-                severity = 'good'
-            elif value < deep_decel_threshold:
-                anomaly_type = 'deep_deceleration'
-                severity = 'critical'
-            elif value < decel_threshold:
-                anomaly_type = 'deceleration'
-                severity = 'high'
+        if len(labels) > 0:
+            # Зоны - участки с одинаковым типом; min/max по всем участкам считаются одним вызовом reduceat
+            run_starts = np.concatenate(([0], np.flatnonzero(np.diff(labels)) + 1))
+            run_ends = np.append(run_starts[1:], len(labels)) - 1
+            run_min = np.minimum.reduceat(fhr_4hz, run_starts)
+            run_max = np.maximum.reduceat(fhr_4hz, run_starts)
             
-            if anomaly_type != current_anomaly:
-                if current_anomaly is not None and anomaly_start_idx is not None:
-                    end_idx = i - 1
-                    duration_seconds = (end_idx - anomaly_start_idx + 1) * 0.25
-                    
-                    if duration_seconds >= 1.0:
-                        zone_start_time = start_time + timedelta(seconds=anomaly_start_idx * 0.25)
-                        zone_end_time = start_time + timedelta(seconds=end_idx * 0.25)
-                        
-                        anomaly_zones.append({
-                            'type': current_anomaly,
-                            'severity': anomaly_severity,
-                            'start_time': zone_start_time.isoformat(),
-                            'end_time': zone_end_time.isoformat(),
-                            'start_time_readable': zone_start_time.strftime('%H:%M:%S'),
-                            'end_time_readable': zone_end_time.strftime('%H:%M:%S'),
-                            'start_index': anomaly_start_idx,
-                            'end_index': end_idx,
-                            'duration_seconds': round(duration_seconds, 1),
-                            'min_value': float(np.min(fhr_4hz[anomaly_start_idx:end_idx+1])),
-                            'max_value': float(np.max(fhr_4hz[anomaly_start_idx:end_idx+1])),
-                            'color': self._get_anomaly_color(current_anomaly, anomaly_severity)
-                        })
-                
-                if anomaly_type is not None:
-                    current_anomaly = anomaly_type
-                    anomaly_severity = severity
-                    anomaly_start_idx = i
+            for run, (start_idx, end_idx) in enumerate(zip(run_starts.tolist(), run_ends.tolist())):
+                label = labels[start_idx]
+                duration_seconds = (end_idx - start_idx + 1) * 0.25
+                if label == 0 or duration_seconds < 1.0:
+                    continue
+                zone_type = GRAPH_ZONE_TYPES[label]
+                # Тяжесть брадикардии определяется первой точкой зоны
+                if zone_type == 'bradycardia':
+                    severity = 'critical' if fhr_4hz[start_idx] < 100 else 'high'
                 else:
-                    current_anomaly = None
-                    anomaly_start_idx = None
-                    anomaly_severity = None
-        
-        if current_anomaly is not None and anomaly_start_idx is not None:
-            end_idx = len(fhr_4hz) - 1
-            duration_seconds = (end_idx - anomaly_start_idx + 1) * 0.25
-            
-            if duration_seconds >= 1.0:
-                zone_start_time = start_time + timedelta(seconds=anomaly_start_idx * 0.25)
+                    severity = GRAPH_ZONE_SEVERITIES[label]
+                zone_start_time = start_time + timedelta(seconds=start_idx * 0.25)
                 zone_end_time = start_time + timedelta(seconds=end_idx * 0.25)
                 
                 anomaly_zones.append({
-                    'type': current_anomaly,
-                    'severity': anomaly_severity,
+                    'type': zone_type,
+                    'severity': severity,
                     'start_time': zone_start_time.isoformat(),
                     'end_time': zone_end_time.isoformat(),
-                    'start_time_readable': zone_start_time.strftime('%H:%M:%S'),
-                    'end_time_readable': zone_end_time.strftime('%H:%M:%S'),
-                    'start_index': anomaly_start_idx,
+                    'start_time_readable': _format_clock(zone_start_time),
+                    'end_time_readable': _format_clock(zone_end_time),
+                    'start_index': start_idx,
                     'end_index': end_idx,
                     'duration_seconds': round(duration_seconds, 1),
-                    'min_value': float(np.min(fhr_4hz[anomaly_start_idx:end_idx+1])),
-                    'max_value': float(np.max(fhr_4hz[anomaly_start_idx:end_idx+1])),
-                    'color': self._get_anomaly_color(current_anomaly, anomaly_severity)
+                    'min_value': float(run_min[run]),
+                    'max_value': float(run_max[run]),
+                    'color': self._get_anomaly_color(zone_type, severity)
                 })
         
         anomaly_stats = {}
@@ -747,7 +1153,8 @@ class PredictionService:
         
         return {
             'timestamps': timestamps,
-            'fhr_values': fhr_4hz.tolist(),
+            # Массив отдается как есть: сериализаторы API и dumps_result пишут его списком чисел
+            'fhr_values': fhr_4hz,
             'baseline': baseline,
             'normal_range': {'min': 110, 'max': 160},
             'anomaly_zones': anomaly_zones,
@@ -758,25 +1165,14 @@ class PredictionService:
                 'start': start_time.isoformat(),
                 'end': (start_time + timedelta(seconds=len(fhr_4hz) * 0.25)).isoformat(),
                 'start_readable': start_time.strftime('%Y-%m-%d %H:%M:%S'),
-                'end_readable': (start_time + timedelta(seconds=len(fhr_4hz) * 0.25)).strftime('%H:%M:%S')
+                'end_readable': _format_clock(start_time + timedelta(seconds=len(fhr_4hz) * 0.25))
             }
         }
     
     def _get_anomaly_color(self, anomaly_type: str, severity: str) -> str:
-        colors = {
-            'acceleration': '#00ff00',
-            'normal': '#90ee90',
-            'deceleration': '#ff6b6b',
-            'deep_deceleration': '#cc0000',
-            'bradycardia': '#800020',
-            'tachycardia': '#ff9500',
-            'severe_tachycardia': '#ff4500',
-            'signal_loss': '#808080',
-            'unknown': '#ffff00'
-        }
-        return colors.get(anomaly_type, '#ffff00')
+        return ANOMALY_COLORS.get(anomaly_type, DEFAULT_ANOMALY_COLOR)
     
-    async def analyze(self, timeseries_data: pd.DataFrame = None, 
+    async def analyze(self, timeseries_data: Optional[Any] = None, 
                      clinical_data: Optional[Dict[str, Any]] = None, 
                      include_graph_data: bool = False,
                      analysis_type: str = 'full') -> Dict[str, Any]:
@@ -784,7 +1180,7 @@ class PredictionService:
         Главный метод анализа с исправленным расчетом времени
         
         Args:
-            timeseries_data: DataFrame с данными КТГ
+            timeseries_data: DataFrame или структурированный массив (как из get_data_from_db) с данными КТГ
             clinical_data: Клинические данные пациента
             include_graph_data: Включить данные для графика
             analysis_type: Тип анализа ('full' или 'short_term')
@@ -806,18 +1202,24 @@ class PredictionService:
                 'timestamp': datetime.now().isoformat()
             }
         
+        # Столбцы одинаково читаются из DataFrame и из структурированного массива
+        if isinstance(timeseries_data, np.ndarray):
+            columns = timeseries_data.dtype.names or ()
+        else:
+            columns = timeseries_data.columns
+        
         # Определяем время начала данных
-        if 'timestamp' in timeseries_data.columns:
-            data_start_time = pd.to_datetime(timeseries_data.iloc[0]['timestamp'])
-        elif 'ts' in timeseries_data.columns:
-            data_start_time = datetime.fromtimestamp(timeseries_data.iloc[0]['ts'])
+        if 'timestamp' in columns:
+            data_start_time = pd.to_datetime(np.asarray(timeseries_data['timestamp'])[0])
+        elif 'ts' in columns:
+            data_start_time = datetime.fromtimestamp(np.asarray(timeseries_data['ts'])[0])
         else:
             data_start_time = datetime.now() - timedelta(seconds=len(timeseries_data))
         
         # Интерполяция данных
-        if 'fhr' in timeseries_data.columns:
-            fhr_1hz = timeseries_data['fhr'].values
-            uc_1hz = timeseries_data['uc'].values if 'uc' in timeseries_data else np.zeros_like(fhr_1hz)
+        if 'fhr' in columns:
+            fhr_1hz = np.asarray(timeseries_data['fhr'])
+            uc_1hz = np.asarray(timeseries_data['uc']) if 'uc' in columns else np.zeros_like(fhr_1hz)
             fhr_4hz = self.feature_extractor.interpolate_signal(fhr_1hz)
             uc_4hz = self.feature_extractor.interpolate_signal(uc_1hz)
             self.logger.info(f"Data interpolated: {len(fhr_1hz)} samples @ 1Hz -> {len(fhr_4hz)} samples @ 4Hz")
@@ -835,11 +1237,10 @@ class PredictionService:
         if len(fhr_4hz) >= LONG_WINDOW_SAMPLES:
             fhr_long = fhr_4hz[-LONG_WINDOW_SAMPLES:]
             uc_long = uc_4hz[-LONG_WINDOW_SAMPLES:]
-            features_long = self.feature_extractor.extract_features(fhr_long, uc_long, 'long')
-            trend_df = pd.DataFrame({'fhr': fhr_long})
-            trend_result = self.trend_analyzer.analyze(trend_df)
+            features_long, features_short = self.feature_extractor.extract_features_pair(fhr_long, uc_long, 'long')
+            trend_result = self.trend_analyzer.analyze(fhr_long)
         else:
-            features_long = self.feature_extractor.extract_features(fhr_4hz, uc_4hz, 'short')
+            features_long, features_short = self.feature_extractor.extract_features_pair(fhr_4hz, uc_4hz, 'short')
             trend_result = {
                 'status': 'insufficient_data',
                 'description': 'Недостаточно данных для тренда',
@@ -849,13 +1250,6 @@ class PredictionService:
                 'recent_change': 0
             }
         
-        if len(fhr_4hz) >= SHORT_WINDOW_SAMPLES:
-            fhr_short = fhr_4hz[-SHORT_WINDOW_SAMPLES:]
-            uc_short = uc_4hz[-SHORT_WINDOW_SAMPLES:]
-            features_short = self.feature_extractor.extract_features(fhr_short, uc_short, 'short')
-        else:
-            features_short = features_long
-        
         # Проверка типа анализа - если требуется только краткосрочный
         if analysis_type == 'short_term':
             # Формируем упрощенный результат только с краткосрочными данными
@@ -877,7 +1271,9 @@ class PredictionService:
                 priority = 'NORMAL'
                 risk_level = 'LOW'
             
-            processing_time_seconds = (datetime.now() - analysis_start_time).total_seconds()
+            # Один отсчет часов на время обработки и метки результата
+            analysis_end_time = datetime.now()
+            processing_time_seconds = (analysis_end_time - analysis_start_time).total_seconds()
             
             return {
                 'type': 'short_term_analysis',
@@ -895,22 +1291,21 @@ class PredictionService:
                     'accelerations': features_short.get('accelerations_count', 0),
                     'signal_loss_ratio': round(features_short.get('signal_loss_ratio', 0), 3)
                 },
-                'timestamp': datetime.now().isoformat(),
-                'timestamp_readable': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'timestamp': analysis_end_time.isoformat(),
+                'timestamp_readable': analysis_end_time.strftime('%Y-%m-%d %H:%M:%S'),
                 'processing_time_ms': round(processing_time_seconds * 1000, 1),
-                'data_window_seconds': len(fhr_short) / TARGET_SAMPLING_RATE
+                'data_window_seconds': min(len(fhr_4hz), SHORT_WINDOW_SAMPLES) / TARGET_SAMPLING_RATE
             }
         
         # Полный анализ (выполняется только если analysis_type == 'full')
         fischer_result = self.fischer_calculator.calculate(features_long)
-        ml_result = self._predict_with_ml(features_long)
+        ml_result = await self._predict_with_ml(features_long)
         clinical_risks = len(clinical_data.get('risk_factors', [])) if clinical_data else 0
         signal_quality = 1.0 - features_long.get('signal_loss_ratio', 0)
         detected_patterns = self._detect_clinical_patterns(features_short, signal_quality, data_start_time)
         
         # Расчет весов для FWBS
-        rule_weight = 0.7 if ml_result['method'] == 'expert_rules' else 0.6
-        fischer_weight = 0.3 if ml_result['method'] == 'expert_rules' else 0.2
+        rule_weight, fischer_weight = FWBS_RULES_WEIGHTS if ml_result['method'] == 'expert_rules' else FWBS_ML_WEIGHTS
         
         # Расчет FWBS и приоритета
         fwbs = self._calculate_fwbs(fischer_result, ml_result, trend_result, signal_quality, clinical_risks)
@@ -921,8 +1316,19 @@ class PredictionService:
         if include_graph_data and len(fhr_4hz) > 0:
             graph_data = self.get_graph_data(fhr_4hz, features_long['baseline_bpm'], data_start_time)
         
-        # Правильный расчет времени обработки
-        processing_time_seconds = (datetime.now() - analysis_start_time).total_seconds()
+        # Правильный расчет времени обработки; тот же момент - метка результата, истории и записи в БД
+        analysis_end_time = datetime.now()
+        processing_time_seconds = (analysis_end_time - analysis_start_time).total_seconds()
+        analysis_end_iso = analysis_end_time.isoformat()
+        data_end_time = data_start_time + timedelta(seconds=len(fhr_1hz))
+        
+        # Показатели, которые стоят и в key_metrics/expert_assessments, и на верхнем уровне результата
+        ml_probability = round(ml_result['hypoxia_probability'], 3)
+        baseline_fhr = round(features_long['baseline_bpm'], 1)
+        variability = round(features_long['variability'], 1)
+        accelerations = features_short.get('accelerations_count', 0)
+        decelerations = features_short.get('decelerations_count', 0)
+        signal_quality_rounded = round(signal_quality, 2)
         
         # Формирование результата
         result = {
@@ -938,15 +1344,15 @@ class PredictionService:
                     'max_score': fischer_result['max_score'],
                     'interpretation': fischer_result['interpretation'],
                     'risk_category': fischer_result['risk_category'],
-                    'weight_in_fwbs': f'{fischer_weight*100:.0f}%',
+                    'weight_in_fwbs': FWBS_WEIGHT_LABELS[fischer_weight],
                     'components': fischer_result['detailed_scores']
                 },
                 'ml_model': {
-                    'hypoxia_probability': round(ml_result['hypoxia_probability'], 3),
+                    'hypoxia_probability': ml_probability,
                     'risk_level': ml_result['risk_level'],
                     'confidence': round(ml_result['confidence'], 2),
                     'method': ml_result['method'],
-                    'weight_in_fwbs': f'{rule_weight*100:.0f}%',
+                    'weight_in_fwbs': FWBS_WEIGHT_LABELS[rule_weight],
                     'model_available': self.model_available,
                     'risk_factors': ml_result.get('risk_factors', [])
                 },
@@ -959,20 +1365,20 @@ class PredictionService:
                 }
             },
             'key_metrics': {
-                'baseline_fhr': round(features_long['baseline_bpm'], 1),
-                'variability': round(features_long['variability'], 1),
-                'accelerations': features_short.get('accelerations_count', 0),
-                'decelerations': features_short.get('decelerations_count', 0),
+                'baseline_fhr': baseline_fhr,
+                'variability': variability,
+                'accelerations': accelerations,
+                'decelerations': decelerations,
                 'deep_decelerations': features_short.get('deep_decelerations_count', 0),
                 'prolonged_decelerations': features_short.get('prolonged_decelerations', 0),
-                'signal_quality': round(signal_quality, 2),
+                'signal_quality': signal_quality_rounded,
                 'signal_loss_ratio': round(features_long.get('signal_loss_ratio', 0), 3)
             },
             'detected_patterns': detected_patterns,
             'detected_patterns_count': len(detected_patterns),
             'metadata': {
-                'analysis_timestamp': datetime.now().isoformat(),
-                'analysis_timestamp_readable': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'analysis_timestamp': analysis_end_iso,
+                'analysis_timestamp_readable': analysis_end_time.strftime('%Y-%m-%d %H:%M:%S'),
                 'service_version': self.version,
                 'analysis_window_minutes': len(fhr_4hz) / (TARGET_SAMPLING_RATE * 60),
                 'processing_time_ms': round(processing_time_seconds * 1000, 1),
@@ -980,20 +1386,20 @@ class PredictionService:
                 'data_source': 'realtime' if timeseries_data is None else 'provided',
                 'data_period': {
                     'start': data_start_time.isoformat(),
-                    'end': (data_start_time + timedelta(seconds=len(fhr_1hz))).isoformat(),
+                    'end': data_end_time.isoformat(),
                     'start_readable': data_start_time.strftime('%Y-%m-%d %H:%M:%S'),
-                    'end_readable': (data_start_time + timedelta(seconds=len(fhr_1hz))).strftime('%Y-%m-%d %H:%M:%S'),
+                    'end_readable': data_end_time.strftime('%Y-%m-%d %H:%M:%S'),
                     'duration_seconds': len(fhr_1hz)
                 }
             },
             'fischer_score': fischer_result['total_score'],
-            'ml_probability': round(ml_result['hypoxia_probability'], 3),
+            'ml_probability': ml_probability,
             'trend_status': trend_result['status'],
-            'baseline_fhr': round(features_long['baseline_bpm'], 1),
-            'variability': round(features_long['variability'], 1),
-            'accelerations': features_short.get('accelerations_count', 0),
-            'decelerations': features_short.get('decelerations_count', 0),
-            'signal_quality': round(signal_quality, 2)
+            'baseline_fhr': baseline_fhr,
+            'variability': variability,
+            'accelerations': accelerations,
+            'decelerations': decelerations,
+            'signal_quality': signal_quality_rounded
         }
         
         # Добавляем данные графика
@@ -1001,33 +1407,35 @@ class PredictionService:
             result['graph_data'] = graph_data
             
             # Добавляем сводку по времени аномалий
-            if graph_data['anomaly_zones']:
-                result['anomaly_timeline'] = []
-                for zone in graph_data['anomaly_zones']:
-                    result['anomaly_timeline'].append({
-                        'type': zone['type'],
-                        'severity': zone['severity'],
-                        'time_range': f"{zone['start_time_readable']} - {zone['end_time_readable']}",
-                        'duration': f"{zone['duration_seconds']} сек",
-                        'values': f"{zone['min_value']:.0f}-{zone['max_value']:.0f} bpm"
-                    })
+            zones = graph_data['anomaly_zones']
+            if zones:
+                # Значения округляются так же, как в anomaly_statistics (формат :.0f)
+                result['anomaly_timeline'] = [{
+                    'type': zone['type'],
+                    'severity': zone['severity'],
+                    'time_range': f"{zone['start_time_readable']} - {zone['end_time_readable']}",
+                    'duration': f"{zone['duration_seconds']} сек",
+                    'values': f"{zone['min_value']:.0f}-{zone['max_value']:.0f} bpm"
+                } for zone in zones]
         
         # Сохранение результата
         self.last_analysis_result = result
         self.analysis_history.append({
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': analysis_end_iso,
             'fwbs': result['fetal_wellbeing_index'],
             'priority': result['action_priority']
         })
-        if len(self.analysis_history) > 100:
-            self.analysis_history.pop(0)
         
-        await self.save_analysis_result(result)
+        await self.save_analysis_result(result, analysis_end_time)
         self.logger.info(f"Analysis completed in {processing_time_seconds:.3f}s: FWBS={fwbs:.1f}, Priority={action_priority}")
         return result
     
     async def start_analysis_loop(self, websocket_callback=None):
         self.logger.info(f"Starting analysis loop (interval: {ANALYSIS_INTERVAL_SECONDS}s)")
+        # Анализы идут по сетке времени от старта цикла: длительность analyze() не сдвигает период,
+        # а после слишком долгого анализа следующий запускается сразу, пропущенные такты не догоняются
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time() + ANALYSIS_INTERVAL_SECONDS
         while True:
             try:
                 result = await self.analyze(include_graph_data=True)
@@ -1038,7 +1446,14 @@ class PredictionService:
                     self.logger.warning(f"   Recommendation: {result.get('recommendation')}")
             except Exception as e:
                 self.logger.error(f"Error in analysis loop: {e}")
-            await asyncio.sleep(ANALYSIS_INTERVAL_SECONDS)
+            delay = next_tick - loop.time()
+            if delay < 0:
+                missed = int(-delay // ANALYSIS_INTERVAL_SECONDS) + 1
+                self.logger.warning(f"Analysis took longer than {ANALYSIS_INTERVAL_SECONDS}s, skipped {missed} tick(s)")
+                next_tick += missed * ANALYSIS_INTERVAL_SECONDS
+            else:
+                await asyncio.sleep(delay)
+                next_tick += ANALYSIS_INTERVAL_SECONDS
 
 # ============================================================================
 # ТЕСТОВЫЙ БЛОК
@@ -1054,12 +1469,14 @@ if __name__ == "__main__":
         print("\n📊 Генерация тестовых данных (1 Гц)...")
         n_samples_1hz = 60
         baseline = 140
-        fhr_1hz = np.full(n_samples_1hz, baseline, dtype=float) + np.random.normal(0, 4, n_samples_1hz)
+        # Фиксированный seed: прогоны теста сравнимы между собой, в том числе по времени обработки
+        rng = np.random.default_rng(42)
+        fhr_1hz = rng.normal(baseline, 4, n_samples_1hz)
         fhr_1hz[30:40] += 20  # Акселерация
         fhr_1hz[45:50] -= 25  # Децелерация
-        uc_1hz = np.random.uniform(10, 30, n_samples_1hz)
-        fhr_1hz = np.clip(fhr_1hz, 50, 210)
-        uc_1hz = np.clip(uc_1hz, 0, 100)
+        uc_1hz = rng.uniform(10, 30, n_samples_1hz)
+        np.clip(fhr_1hz, 50, 210, out=fhr_1hz)
+        np.clip(uc_1hz, 0, 100, out=uc_1hz)
         
         # Создаем DataFrame с временными метками
         start_time = datetime.now() - timedelta(seconds=n_samples_1hz)
@@ -1138,5 +1555,6 @@ if __name__ == "__main__":
         else:
             print(f"\n❌ Ошибка: {result['message']}")
         print("="*80)
+        await service.close()
     
     asyncio.run(test_service())
\ No newline at end of file
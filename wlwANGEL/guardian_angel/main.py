@@ -1,11 +1,25 @@
 import json
-import socket
+import asyncio
 import time
 import os
 import sys
 sys.path.append(os.path.dirname(__file__))
 from db_manager import DBManager
 
+try:
+    import orjson
+except ImportError:  # без orjson используется стандартный json
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:  # без uvloop работает стандартный цикл событий asyncio
+    uvloop = None
+
+# Обе функции разбирают строку прямо из bytes, без декодирования в str;
+# orjson.JSONDecodeError наследуется от json.JSONDecodeError
+json_loads = orjson.loads if orjson is not None else json.loads
+
 HOST = '127.0.0.1'
 PORT = 65432
 
@@ -21,33 +35,57 @@ def safe_float(x, fallback=None):
     except Exception:
         return fallback
 
-def start_receive():
+async def start_receive():
     db = DBManager()
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.connect((HOST, PORT))
-        buffer = ''
+    # DBManager сам копит строки и пишет их пачками через executemany; при закрытии сокета
+    # или Ctrl+C stop() сбрасывает остаток буфера, иначе последние секунды записи терялись бы
+    try:
+        await receive_loop(db)
+    finally:
+        db.stop()
+
+async def receive_loop(db):
+    reader, writer = await asyncio.open_connection(HOST, PORT)
+    skip_line = False
+    try:
         while True:
-            data = s.recv(4096)
-            if not data:
+            # Деление потока на строки делает StreamReader: readuntil ищет разделитель в своем буфере
+            try:
+                line = await reader.readuntil(b'\n')
+            except asyncio.IncompleteReadError:
                 break
-            buffer += data.decode('utf-8', errors='ignore')
-            while '\n' in buffer:
-                line, buffer = buffer.split('\n', 1)
-                if not line.strip():
-                    continue
-                try:
-                    data_json = json.loads(line)
-                    ts = int(time.time())
-                    bpm = data_json.get('bpm', [None, None])
-                    uterus = data_json.get('uterus', [None, None])
-                    bpm_time = safe_float(bpm[0], fallback=None)
-                    bpm_value = safe_float(bpm[1], fallback=None)
-                    uterus_time = safe_float(uterus[0], fallback=None)
-                    uterus_value = safe_float(uterus[1], fallback=None)
-                    db.add(ts, bpm_time, bpm_value, uterus_time, uterus_value)
-                    print(f"Buffered: ts={ts}, bpm_time={bpm_time}, bpm_value={bpm_value}, uterus_time={uterus_time}, uterus_value={uterus_value}")
-                except Exception as e:
-                    print(f"Error parsing message: {e}")
+            except asyncio.LimitOverrunError as e:
+                # Строка длиннее лимита буфера: прочитанная часть отбрасывается, остаток строки
+                # до разделителя пропускается следующим чтением, прием продолжается
+                print(f"Error reading message: {e}")
+                await reader.readexactly(e.consumed)
+                skip_line = True
+                continue
+            if skip_line:
+                skip_line = False
+                continue
+            if not line.strip():
+                continue
+            try:
+                data_json = json_loads(line)
+                ts = int(time.time())
+                bpm = data_json.get('bpm', [None, None])
+                uterus = data_json.get('uterus', [None, None])
+                bpm_time = safe_float(bpm[0], fallback=None)
+                bpm_value = safe_float(bpm[1], fallback=None)
+                uterus_time = safe_float(uterus[0], fallback=None)
+                uterus_value = safe_float(uterus[1], fallback=None)
+                # Других задач в цикле нет, поэтому add() вызывается напрямую, без пула потоков
+                db.add(ts, bpm_time, bpm_value, uterus_time, uterus_value)
+                print(f"Buffered: ts={ts}, bpm_time={bpm_time}, bpm_value={bpm_value}, uterus_time={uterus_time}, uterus_value={uterus_value}")
+            except Exception as e:
+                print(f"Error parsing message: {e}")
+    finally:
+        writer.close()
 
 if __name__ == '__main__':
-    start_receive()
+    # С uvloop цикл событий работает на libuv
+    if uvloop is not None:
+        uvloop.run(start_receive())
+    else:
+        asyncio.run(start_receive())
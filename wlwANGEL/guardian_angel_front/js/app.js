@@ -75,9 +75,15 @@ class KTGDashboard {
                         break;
                         
                     case 'patient_info_updated':
+                    case 'clinical_data_updated':
+                    case 'clinical_data_cleared':
                         this.handlePatientInfoUpdate(message);
                         break;
-                        
+
+                    case 'patients_batch':
+                        message.updates.forEach(update => this.handlePatientInfoUpdate(update));
+                        break;
+
                     case 'welcome':
                         console.log('Welcome message:', message.message);
                         break;
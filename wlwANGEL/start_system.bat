@@ -62,7 +62,7 @@ timeout /t 3 /nobreak >nul
 
 REM 2. START API SERVER (from guardian_angel)
 echo 2. [API] Starting API server...
-start "Guardian Angel API" cmd /k "cd /d "%BACKEND_PATH%" && uvicorn api:app --reload --host 0.0.0.0 --port 8000 && echo API server stopped && pause"
+start "Guardian Angel API" cmd /k "cd /d "%BACKEND_PATH%" && uvicorn api:app --reload --host 0.0.0.0 --port 8000 --loop auto --ws-per-message-deflate false && echo API server stopped && pause"
 
 echo    [INFO] Waiting for API to start (5 sec)...
 timeout /t 5 /nobreak >nul